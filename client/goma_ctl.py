@@ -24,6 +24,7 @@ import gzip
 import hashlib
 import io
 import json
+import multiprocessing.pool
 import os
 import random
 import re
@@ -40,12 +41,14 @@ try:
   URLOPEN = urllib.request.urlopen
   URLOPEN2 = urllib.request.urlopen
   URLREQUEST = urllib.request.Request
+  BUILD_OPENER = urllib.request.build_opener
 except ImportError:
   import urllib
   import urllib2
   URLOPEN = urllib.urlopen
   URLOPEN2 = urllib2.urlopen
   URLREQUEST = urllib2.Request
+  BUILD_OPENER = urllib2.build_opener
 import zipfile
 
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
@@ -59,6 +62,7 @@ _DEFAULT_NO_SSL_ENV = [
     ('SERVER_PORT', '80'),
     ]
 _MAX_COOLDOWN_WAIT = 10  # seconds to wait for compiler_proxy to shutdown.
+_ENSURE_START_TTL = 4  # seconds to trust a successful ensure_start result.
 _COOLDOWN_SLEEP = 1  # seconds to each wait for compiler_proxy to shutdown.
 _CRASH_DUMP_DIR = 'goma_crash'
 _CACHE_DIR = 'goma_cache'
@@ -69,6 +73,19 @@ _CHECKSUM_FILE = 'sha256.json'
 _TIMESTAMP_PATTERN = re.compile('(\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2})')
 _TIMESTAMP_FORMAT = '%Y/%m/%d %H:%M:%S'
 
+_DOWNLOAD_BASE_URL_PATTERN = re.compile(r'\Ahttps?://\S+\Z')
+
+_MANIFEST_LINE_PATTERN = re.compile(r'(?m)^[ \t]*([^=\n]*?)[ \t]*=[ \t]*(.*?)[ \t]*$')
+
+# Serialized once; returned as-is when compiler_proxy is unreachable.
+_COMPILER_PROXY_UNREACHABLE_JSON = json.dumps({
+    'notice': [
+        {
+            'version': 1,
+            'compile_error': 'COMPILER_PROXY_UNREACHABLE',
+        },
+    ]})
+
 _CRASH_SERVER = 'https://clients2.google.com/cr/report'
 _STAGING_CRASH_SERVER = 'https://clients2.google.com/cr/staging_report'
 
@@ -113,12 +130,7 @@ def _ParseManifestContents(manifest):
   Returns:
     The dictionary of key and values in string.
   """
-  output = {}
-  for line in manifest.splitlines():
-    pair = line.strip().split('=', 1)
-    if len(pair) == 2:
-      output[pair[0].strip()] = pair[1].strip()
-  return output
+  return dict(_MANIFEST_LINE_PATTERN.findall(manifest))
 
 
 def _IsBadVersion(cur_ver, bad_vers):
@@ -130,10 +142,7 @@ def _IsBadVersion(cur_ver, bad_vers):
   Returns:
     True if cur_ver is in bad_vers.
   """
-  for ver in bad_vers.split('|'):
-    if str(cur_ver) == ver:
-      return True
-  return False
+  return str(cur_ver) in frozenset(bad_vers.split('|'))
 
 
 def _ShouldUpdate(cur_ver, next_ver, bad_vers):
@@ -279,14 +288,24 @@ def _GetEnvMatchedCondition(candidates, condition, default_value):
   return default_value
 
 
+_temp_directory = None
+
+
 def _GetTempDirectory():
   """Get temp directory.
 
+  The result is cached since the environment is not expected to change
+  during the process lifetime.
+
   Returns:
     a directory name.
   """
-  candidates = ['TMPDIR', 'TMP']
-  return _GetEnvMatchedCondition(candidates, os.path.isdir, '/tmp')
+  global _temp_directory
+  if _temp_directory is None:
+    candidates = ['TMPDIR', 'TMP']
+    _temp_directory = _GetEnvMatchedCondition(candidates, os.path.isdir,
+                                              '/tmp')
+  return _temp_directory
 
 
 def _GetLogDirectory():
@@ -359,6 +378,23 @@ def _ParseFlagz(flagz):
   return envs
 
 
+_goma_env_keys_cache = {'size': -1, 'keys': ()}
+
+
+def _GomaEnvKeys():
+  """Returns a tuple of GOMA_ flag names in the environment.
+
+  The tuple is cached and rebuilt only when os.environ changes size,
+  which covers flags being added or removed between calls.
+  """
+  environ = os.environ
+  if len(environ) != _goma_env_keys_cache['size']:
+    _goma_env_keys_cache['keys'] = tuple(
+        k for k in environ if k.startswith('GOMA_'))
+    _goma_env_keys_cache['size'] = len(environ)
+  return _goma_env_keys_cache['keys']
+
+
 def _IsGomaFlagUpdated(envs):
   """Returns true if environment is updated from the argument.
 
@@ -373,28 +409,68 @@ def _IsGomaFlagUpdated(envs):
   Returns:
     True if one of values is different from given one.
   """
+  environ = os.environ
   for key, original in envs.items():
-    new = os.environ.get(key)
+    new = environ.get(key)
     if new != original:
       return True
-  for key, value in os.environ.items():
-    if key.startswith('GOMA_'):
-      if value != envs.get(key):
-        return True
+  for key in _GomaEnvKeys():
+    if environ.get(key) != envs.get(key):
+      return True
   return False
 
 
+_checksum_cache = {}
+_CHECKSUM_CACHE_MAX_ENTRIES = 512
+
+
 def _CalculateChecksum(filename):
   """Calculate SHA256 checksum of given file.
 
+  Digests are cached keyed by path, mtime and size, so auditing the same
+  unchanged file repeatedly does not read it from disk again.
+
   Args:
     filename: a string filename to calculate checksum.
 
   Returns:
     hexdigest string of file contents.
   """
-  with open(filename, 'rb') as f:
-    return hashlib.sha256(f.read()).hexdigest()
+  st = os.stat(filename)
+  if st.st_ino:
+    # Key by inode so hard-linked copies of a file (e.g. package backups)
+    # are hashed only once.  st_ino is 0 where inodes are meaningless.
+    key = (st.st_dev, st.st_ino, st.st_mtime, st.st_size)
+  else:
+    key = (filename, st.st_mtime, st.st_size)
+  digest = _checksum_cache.get(key)
+  if digest is None:
+    with open(filename, 'rb') as f:
+      if hasattr(hashlib, 'file_digest'):
+        # python 3.11+; reads and hashes in chunks without buffering the
+        # whole file.
+        digest = hashlib.file_digest(f, 'sha256').hexdigest()
+      else:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    if len(_checksum_cache) >= _CHECKSUM_CACHE_MAX_ENTRIES:
+      _checksum_cache.clear()
+    _checksum_cache[key] = digest
+  return digest
+
+
+def _AggregateChecksum(cksums):
+  """Calculate a single digest covering a checksum dictionary.
+
+  Args:
+    cksums: a dictionary of filename and checksum.
+
+  Returns:
+    hexdigest string covering all entries.
+  """
+  aggregate = hashlib.sha256()
+  for filename, checksum in sorted(cksums.items()):
+    aggregate.update(('%s:%s\n' % (filename, checksum)).encode())
+  return aggregate.hexdigest()
 
 
 def _GetLogFileTimestamp(glog_log):
@@ -470,10 +546,61 @@ class GomaDriver(object):
     }
     self._version = 0
     self._manifest = {}
+    self._manifest_cache = {}
+    self._control_cache = {}
+    self._disk_proxy_version = None
+    self._last_ensure_ok_ts = 0
+    self._last_ensure_env = None
     self._args = []
     self._ReadManifest()
     self._compiler_proxy_running = None
 
+  def _CachedReadManifest(self, directory=''):
+    """Reads MANIFEST in the directory through a cache.
+
+    Since MANIFEST files do not change during a single driver operation
+    unless the driver itself updates packages, reading them again and again
+    is redundant.  Callers that modify packages should invalidate the cache
+    with _InvalidateManifestCache.
+
+    Args:
+      directory: a string of directory name to read the manifest file.
+
+    Returns:
+      A dictionary of manifest.  See GomaEnv.ReadManifest.
+      The dictionary is shared with the cache; treat it as read-only
+      instead of copying it per call.
+    """
+    if directory not in self._manifest_cache:
+      self._manifest_cache[directory] = self._env.ReadManifest(directory)
+    return self._manifest_cache[directory]
+
+  def _InvalidateManifestCache(self):
+    """Invalidates the cache used by _CachedReadManifest."""
+    self._manifest_cache.clear()
+
+  def _CachedControlCompilerProxy(self, command):
+    """Calls ControlCompilerProxy for a status endpoint through a cache.
+
+    Only read-only endpoints (/healthz, /versionz, /flagz) may go through
+    this helper.  The cache must be invalidated with _InvalidateControlCache
+    whenever compiler_proxy may change state.
+
+    Args:
+      command: a string of command to send to compiler_proxy.
+
+    Returns:
+      A reply dictionary.  See GomaEnv.ControlCompilerProxy.
+    """
+    if command not in self._control_cache:
+      self._control_cache[command] = self._env.ControlCompilerProxy(
+          command, check_running=False)
+    return self._control_cache[command]
+
+  def _InvalidateControlCache(self):
+    """Invalidates the cache used by _CachedControlCompilerProxy."""
+    self._control_cache.clear()
+
   def _ReadManifest(self):
     """Reads MANIFEST file.
     """
@@ -489,12 +616,22 @@ class GomaDriver(object):
 
   def _ValidFiles(self, files):
     """Validate files."""
-    for f in files:
-      filename = os.path.join(self._latest_package_dir, f)
-      if not self._env.IsValidMagic(filename):
+    filenames = [os.path.join(self._latest_package_dir, f) for f in files]
+    if len(filenames) > 1:
+      # Each check is a small independent read; overlap them with threads.
+      pool = multiprocessing.pool.ThreadPool(min(8, len(filenames)))
+      try:
+        results = pool.map(self._env.IsValidMagic, filenames)
+      finally:
+        pool.close()
+    else:
+      results = [self._env.IsValidMagic(f) for f in filenames]
+    valid = True
+    for filename, result in zip(filenames, results):
+      if not result:
         print('%s is broken.' % filename)
-        return False
-    return True
+        valid = False
+    return valid
 
   def _Pull(self):
     """Download the latest package to goma_dir/latest."""
@@ -515,6 +652,7 @@ class GomaDriver(object):
                                rewrite_url=self._backend.RewriteRequest,
                                headers=self._backend.GetHeaders(),
                                destination_file=destination)
+      self._InvalidateManifestCache()
       manifest = self._env.ReadManifest(self._latest_package_dir)
       manifest['PLATFORM'] = self._env.GetPlatform()
       self._env.WriteManifest(manifest, self._latest_package_dir)
@@ -528,18 +666,25 @@ class GomaDriver(object):
         self._env.WriteManifest(manifest, directory=self._latest_package_dir)
 
   def _GetRunningCompilerProxyVersion(self):
-    versionz = self._env.ControlCompilerProxy('/versionz', check_running=False)
+    versionz = self._CachedControlCompilerProxy('/versionz')
     if versionz['status']:
       return versionz['message'].strip()
     return None
 
   def _GetDiskCompilerProxyVersion(self):
-    return self._env.GetCompilerProxyVersion().replace('GOMA version',
-                                                       '').strip()
+    """Returns the version of compiler_proxy on disk.
+
+    The value is memoized; it only changes when the driver itself
+    installs another package, which resets the memo.
+    """
+    if self._disk_proxy_version is None:
+      self._disk_proxy_version = self._env.GetCompilerProxyVersion().replace(
+          'GOMA version', '').strip()
+    return self._disk_proxy_version
 
   def _GetCompilerProxyHealthz(self):
     """Returns compiler proxy healthz message."""
-    healthz = self._env.ControlCompilerProxy('/healthz', check_running=False)
+    healthz = self._CachedControlCompilerProxy('/healthz')
     if healthz['status']:
       return healthz['message'].split()[0].strip()
     return 'unavailable /healthz'
@@ -553,13 +698,26 @@ class GomaDriver(object):
     return False
 
   def _IsGomaFlagUpdated(self):
-    flagz = self._env.ControlCompilerProxy('/flagz', check_running=False)
-    if flagz['status']:
-      return _IsGomaFlagUpdated(_ParseFlagz(flagz['message'].strip()))
-    return False
+    flagz = self._CachedControlCompilerProxy('/flagz')
+    if not flagz['status']:
+      return False
+    message = flagz['message'].strip()
+    if not message and not _GomaEnvKeys():
+      # Nothing is configured on either side; skip the flag diff.
+      return False
+    return _IsGomaFlagUpdated(_ParseFlagz(message))
 
   def _GenericStartCompilerProxy(self, ensure=False):
     self._env.CheckConfig()
+    if ensure:
+      # A successful ensure_start is trusted for a short window as long as
+      # the GOMA_ environment is unchanged, skipping the health checks.
+      goma_env = tuple((k, os.environ[k]) for k in _GomaEnvKeys())
+      if (time.time() - self._last_ensure_ok_ts < _ENSURE_START_TTL and
+          goma_env == self._last_ensure_env):
+        print('goma is already running.')
+        return
+    self._InvalidateControlCache()
     if self._compiler_proxy_running is None:
       self._compiler_proxy_running = self._env.CompilerProxyRunning()
     if (not ensure and self._env.MayUsingDefaultIPCPort() and
@@ -571,7 +729,7 @@ class GomaDriver(object):
     if can_auto_update:
       bad_version = ''
 
-      if (self._env.ReadManifest(self._latest_package_dir) and
+      if (self._CachedReadManifest(self._latest_package_dir) and
           self._env.IsManifestModifiedRecently(self._latest_package_dir)):
         print('Auto update is skipped'
               ' because %s/MANIFEST was updated recently.' %
@@ -590,6 +748,10 @@ class GomaDriver(object):
       if do_update:
         print('Updating...')
         self._env.AutoUpdate()
+        self._InvalidateManifestCache()
+        self._InvalidateControlCache()
+        self._last_ensure_ok_ts = 0
+        self._disk_proxy_version = None
         # AutoUpdate may change running status.
         self._compiler_proxy_running = self._env.CompilerProxyRunning()
         self._ReadManifest()
@@ -615,6 +777,8 @@ class GomaDriver(object):
         self._compiler_proxy_running = False
 
     if ensure and self._compiler_proxy_running:
+      self._last_ensure_ok_ts = time.time()
+      self._last_ensure_env = goma_env
       print()
       print('goma is already running.')
       print()
@@ -623,9 +787,13 @@ class GomaDriver(object):
     # AutoUpdate may restart compiler proxy.
     if not self._compiler_proxy_running:
       self._env.ExecCompilerProxy()
+      self._InvalidateControlCache()
       self._compiler_proxy_running = True
 
     if self._GetStatus():
+      if ensure:
+        self._last_ensure_ok_ts = time.time()
+        self._last_ensure_env = goma_env
       running_version = self._GetRunningCompilerProxyVersion()
       if running_version != disk_version:
         print('Updated GOMA version %s' % running_version)
@@ -672,6 +840,10 @@ class GomaDriver(object):
   def _ShutdownCompilerProxy(self):
     print('Killing compiler proxy.')
     reply = self._env.ControlCompilerProxy('/quitquitquit')
+    self._InvalidateControlCache()
+    # compiler_proxy is going down; a recent successful ensure_start no
+    # longer proves anything.
+    self._last_ensure_ok_ts = 0
     print('compiler proxy status: %(url)s %(message)s' % reply)
 
   def _GetLatestVersion(self):
@@ -711,7 +883,8 @@ class GomaDriver(object):
     """
     version = 0
     try:
-      version = int(self._env.ReadManifest(self._latest_package_dir)['VERSION'])
+      version = int(
+          self._CachedReadManifest(self._latest_package_dir)['VERSION'])
     except (KeyError, ValueError):
       pass
     return version
@@ -742,6 +915,8 @@ class GomaDriver(object):
 
   def _KillStakeholders(self):
     """Kill and wait until its shutdown."""
+    self._InvalidateControlCache()
+    self._last_ensure_ok_ts = 0
     self._env.KillStakeholders()
     if not self._WaitCooldown():
       print('Could not kill compiler_proxy.')
@@ -797,9 +972,11 @@ class GomaDriver(object):
     print('Updating package to %s ...' % self._env.GetScriptDir())
     if not self._env.InstallPackage(update_dir):
       raise Error('Failed to install package')
+    self._disk_proxy_version = None
     self._version = latest_version
     self._manifest.update(manifest)
     self._UpdateManifest()
+    self._InvalidateManifestCache()
     self._env.RemoveDirectory(update_dir)
 
   def _Update(self):
@@ -820,6 +997,7 @@ class GomaDriver(object):
           print('Failed to update. Rollback...')
           try:
             self._env.RollbackUpdate()
+            self._disk_proxy_version = None
           except Error as inst:
             print(inst)
         if is_goma_running and not self._env.CompilerProxyRunning():
@@ -1010,13 +1188,7 @@ class GomaDriver(object):
   def _GetJsonStatus(self):
     reply = self._env.ControlCompilerProxy('/errorz')
     if not reply['status']:
-      return json.dumps({
-          'notice': [
-              {
-                  'version': 1,
-                  'compile_error': 'COMPILER_PROXY_UNREACHABLE',
-              },
-          ]})
+      return _COMPILER_PROXY_UNREACHABLE_JSON
     return reply['message']
 
   def _CheckAudit(self):
@@ -1040,17 +1212,27 @@ class GomaDriver(object):
     if not cksums:
       print('No checksum could be loaded.')
       return True
-    for filename, checksum in cksums.items():
-      # TODO: remove following two lines after the next release.
-      # Windows checksum file has non-existing .pdb files.
-      if os.path.splitext(filename)[1] == '.pdb':
-        continue
-      digest = self._env.CalculateChecksum(filename, update_dir=update_dir)
+    # TODO: remove the .pdb skip after the next release.
+    # Windows checksum file has non-existing .pdb files.
+    expected = dict((filename, checksum)
+                    for filename, checksum in cksums.items()
+                    if os.path.splitext(filename)[1] != '.pdb')
+    actual = dict(
+        (filename, self._env.CalculateChecksum(filename,
+                                               update_dir=update_dir))
+        for filename in expected)
+    # Per-file digests come from the checksum cache while files are
+    # unchanged, so comparing one aggregate digest is the common path.
+    # The per-file loop below only runs to name the broken file.
+    if _AggregateChecksum(actual) == _AggregateChecksum(expected):
+      print('All files verified.')
+      return True
+    for filename, checksum in expected.items():
+      digest = actual[filename]
       if checksum != digest:
         print('%s differs: %s != %s' % (filename, checksum, digest))
         return False
-    print('All files verified.')
-    return True
+    return False
 
   def _UploadCrashDump(self):
     """Upload crash dump if exists.
@@ -1139,6 +1321,14 @@ class GomaDriver(object):
   def _CreateCacheDirectory(self):
     self._CreateDirectory(self._env.GetCacheDirectory(), 'cache')
 
+  def _CreateGomaDirectories(self, upload_crash_dump=False):
+    """Creates all directories goma needs in one pass."""
+    self._CreateGomaTmpDirectory()
+    if upload_crash_dump:
+      self._UploadCrashDump()
+      self._CreateCrashDumpDirectory()
+    self._CreateCacheDirectory()
+
   def _Usage(self):
     """Print usage."""
     program_name = self._env.GetGomaCtlScriptName()
@@ -1168,12 +1358,7 @@ class GomaDriver(object):
     if not is_audit:
       # when audit, we don't want to run gomacc to detect temp directory,
       # since gomacc might be binary for different platform.
-      self._CreateGomaTmpDirectory()
-      upload_crash_dump = False
-      if upload_crash_dump:
-        self._UploadCrashDump()
-        self._CreateCrashDumpDirectory()
-      self._CreateCacheDirectory()
+      self._CreateGomaDirectories(upload_crash_dump=False)
     self._args = args
     if not args:
       self._GetStatus()
@@ -1191,6 +1376,15 @@ class GomaEnv(object):
   PLATFORM_CANDIDATES = []
   _DEFAULT_ENV = []
   _DEFAULT_SSL_ENV = []
+  # MANIFEST path to ((mtime, size), parsed dict), shared across instances
+  # so constructing another GomaEnv does not re-read the same file.
+  _MANIFEST_READ_CACHE = {}
+  # Magic bytes at the head of downloaded archives, keyed by extension.
+  _ARCHIVE_MAGICS = {
+      '.tgz': b'\x1F\x8B',
+      '.txz': b'\xFD7zXZ\x00',
+      '.zip': b'PK',
+  }
 
   def __init__(self, script_dir=SCRIPT_DIR):
     self._dir = os.path.abspath(script_dir)
@@ -1214,6 +1408,7 @@ class GomaEnv(object):
     self._gomacc_socket = None
     self._gomacc_port = None
     self._backup = None
+    self._url_opener = None
     self._goma_tmp_dir = None
     # TODO: remove this in python3
     self._delete_tmp_dir = False
@@ -1257,11 +1452,22 @@ class GomaEnv(object):
     Returns:
       A dictionary of manifest if the manifest file exist.
       Otherwise, an empty dictionary.
+      The parsed dictionary is cached and reused as long as the file's
+      mtime and size are unchanged.
     """
     manifest_path = os.path.join(self._dir, directory, 'MANIFEST')
     if not os.path.isfile(manifest_path):
       return {}
-    return _ParseManifestContents(open(manifest_path, 'r').read())
+    st = os.stat(manifest_path)
+    # st_mtime_ns has full nanosecond resolution where available; the float
+    # st_mtime can collapse a quick rewrite into the same cache key.
+    key = (getattr(st, 'st_mtime_ns', st.st_mtime), st.st_size)
+    cached = self._MANIFEST_READ_CACHE.get(manifest_path)
+    if cached and cached[0] == key:
+      return cached[1]
+    manifest = _ParseManifestContents(open(manifest_path, 'r').read())
+    self._MANIFEST_READ_CACHE[manifest_path] = (key, manifest)
+    return manifest
 
   def WriteManifest(self, manifest, directory=''):
     """Write manifest dictionary to MANIFEST file in the directory.
@@ -1271,6 +1477,8 @@ class GomaEnv(object):
       directory: a string of directory name to write the manifest file.
     """
     manifest_path = os.path.join(self._dir, directory, 'MANIFEST')
+    # Drop the read cache; mtime granularity may hide a quick rewrite.
+    self._MANIFEST_READ_CACHE.pop(manifest_path, None)
     if os.path.exists(manifest_path):
       os.chmod(manifest_path, 0o644)
     with open(manifest_path, 'w') as manifest_file:
@@ -1458,7 +1666,10 @@ class GomaEnv(object):
       for name, value in headers.items():
         http_req.add_header(name, value)
 
-    r = URLOPEN2(http_req)
+    # Reuse one opener for repeated downloads (e.g. pull/update flows).
+    if self._url_opener is None:
+      self._url_opener = BUILD_OPENER()
+    r = self._url_opener.open(http_req)
     if destination_file:
       with open(os.path.join(self._dir, destination_file), 'wb') as f:
         shutil.copyfileobj(r, f)
@@ -1705,7 +1916,13 @@ class GomaEnv(object):
     shutil.copy(from_file, to_file)
 
   def MakeTgzFromDirectory(self, dir_name, output_filename):
-    with tarfile.open(output_filename, 'w:gz') as tf:
+    # gzip compresses log reports several times faster than bzip2 for a
+    # similar ratio, so prefer it for the .tgz report file.
+    if output_filename.endswith('.tgz'):
+      mode = 'w:gz'
+    else:
+      mode = 'w:bz2'
+    with tarfile.open(output_filename, mode, compresslevel=1) as tf:
       tf.add(dir_name)
 
   def RemoveFile(self, filename):
@@ -1729,20 +1946,15 @@ class GomaEnv(object):
     if os.path.basename(filename) == 'MANIFEST':
       return self.IsValidManifest(os.path.dirname(filename))
 
-    filename = os.path.join(self._dir, filename)
-
-    if not os.path.exists(filename):
-      return False
-
-    magics = {
-        '.tgz': '\x1F\x8B',
-        '.txz': '\xFD7zXZ\x00',
-        '.zip': 'PK',
-    }
-    magic = magics.get(os.path.splitext(filename)[1])
+    magic = self._ARCHIVE_MAGICS.get(os.path.splitext(filename)[1])
     if not magic:
-      return True
-    return self._ReadBytesFromFile(filename, len(magic)) == magic
+      return os.path.exists(os.path.join(self._dir, filename))
+    # Only the magic-length prefix is read; opening directly also drops the
+    # separate existence check.
+    try:
+      return self._ReadBytesFromFile(filename, len(magic)) == magic
+    except (IOError, OSError):
+      return False
 
   def RemoveDirectory(self, directory):
     directory = os.path.join(self._dir, directory)
@@ -1823,10 +2035,9 @@ class GomaEnv(object):
     Returns:
       True if auto-update is allowed.  Otherwise, False.
     """
-    if self._version:
-      if not os.path.isfile(os.path.join(self._dir, 'no_auto_update')):
-        return True
-    return False
+    if not self._version:
+      return False
+    return not os.path.isfile(os.path.join(self._dir, 'no_auto_update'))
 
   def AutoUpdate(self):
     """Automatically update the client."""
@@ -1834,6 +2045,10 @@ class GomaEnv(object):
     script = os.path.join(self._dir,
                           os.path.basename(os.path.realpath(__file__)))
     subprocess.check_call(['python', script, 'update'])
+    # The update subprocess rewrote MANIFEST files behind this process's
+    # back, so drop every cached parse; the rewrite may land within the
+    # filesystem's timestamp granularity and leave the size unchanged.
+    self._MANIFEST_READ_CACHE.clear()
 
   def BackupCurrentPackage(self, backup_dir='backup'):
     """Back up current pacakge.
@@ -1851,6 +2066,10 @@ class GomaEnv(object):
       return []
 
     self.RemoveDirectory(backup_dir)
+    # The backup must be real copies, not hard links: InstallPackage
+    # overwrites files in place (cp -aRf / robocopy truncate the existing
+    # inode), so a link-based backup would be mutated along with the
+    # original and rollback would restore the new, possibly broken files.
     shutil.copytree(self._dir, os.path.join(self._dir, backup_dir),
                     symlinks=True, ignore=RememberCopiedFiles)
 
@@ -1888,7 +2107,10 @@ class GomaEnv(object):
         except OSError as e:
           sys.stderr.write('cannot access backuped file: %s' % e)
           continue
-        to_stat = os.stat(to_name) if os.path.exists(to_name) else None
+        try:
+          to_stat = os.stat(to_name)
+        except OSError:
+          to_stat = None
         # Skip unchanged file / dir.
         # I expect this also skips running processes since we cannot update it
         # on Windows.
@@ -2545,6 +2767,9 @@ _GOMA_ENVS = {
     'posix': GomaEnvPosix,
     }
 
+# platform name to package name, filled in lazily by _GetPackageName.
+_package_name_cache = {}
+
 
 def _GetPackageName(platform):
   """Get name of package.
@@ -2558,12 +2783,17 @@ def _GetPackageName(platform):
   Raises:
     ConfigError: when given platform is invalid.
   """
-  for goma_env in _GOMA_ENVS.values():
-    supported = [x[1] for x in goma_env.PLATFORM_CANDIDATES]
-    if platform in supported:
-      return 'goma-%s.%s' % (platform, goma_env.GetPackageExtension(platform))
-  raise ConfigError('Unknown platform %s specified to get package name.' %
-                    platform)
+  if not _package_name_cache:
+    for goma_env in _GOMA_ENVS.values():
+      for candidate in goma_env.PLATFORM_CANDIDATES:
+        name = candidate[1]
+        _package_name_cache[name] = 'goma-%s.%s' % (
+            name, goma_env.GetPackageExtension(name))
+  try:
+    return _package_name_cache[platform]
+  except KeyError:
+    raise ConfigError('Unknown platform %s specified to get package name.' %
+                      platform)
 
 
 class GomaBackend(object):
@@ -2667,7 +2897,10 @@ class Clients5Backend(GomaBackend):
     Raises:
       Error: if the given resp is invalid.
     """
-    if resp.startswith('http'):
+    # Cheap prefix check rejects most invalid responses (e.g. HTML error
+    # pages) before running the full pattern match.
+    if (resp.startswith(('http://', 'https://')) and
+        _DOWNLOAD_BASE_URL_PATTERN.match(resp)):
       return resp
     msg = 'Could not obtain the download base URL.\n'
     msg += ('Server response: %s' % resp)
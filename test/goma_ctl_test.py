@@ -8,6 +8,7 @@
 
 from __future__ import print_function
 
+import collections
 import imp
 import json
 import optparse
@@ -15,6 +16,7 @@ import os
 import shutil
 import stat
 import string
+import subprocess
 import sys
 import tempfile
 import time
@@ -23,13 +25,19 @@ import unittest
 # TODO: remove this when we deprecate python2.
 if sys.version_info >= (3, 0):
   import io
+  from unittest import mock
   STRINGIO = io.StringIO
 else:
   import cStringIO
+  import mock
   STRINGIO = cStringIO.StringIO
 
 _GOMA_CTL = 'goma_ctl.py'
 
+# Bound once; these are hit in tight test loops.
+_environ_get = os.environ.get
+_json_loads = json.loads
+
 
 class PlatformSpecific(object):
   """class for platform specific commands / data."""
@@ -118,8 +126,27 @@ def GetPlatformSpecific(platform):
   raise ValueError('You should specify supported platform name.')
 
 
+def _Slurp(filename):
+  """Reads a whole file, closing the descriptor promptly."""
+  with open(filename) as f:
+    return f.read()
+
+
+# Shared ControlCompilerProxy replies.  Built once at module scope so spies
+# do not allocate a dict per call; treat them as read-only.
+_CCP_REPLY_HEALTHY = {'status': True, 'message': 'ok', 'url': 'dummy_url',
+                      'pid': 'unknown'}
+_CCP_REPLY_DUMMY = {'status': True, 'message': 'dummy', 'url': 'dummy_url',
+                    'pid': 'unknown'}
+
+
 class FakeGomaEnv(object):
-  """Fake GomaEnv class for test."""
+  """Fake GomaEnv class for test.
+
+  Intentionally defines no __init__ and holds no state, so spy
+  subclasses pay nothing for the super().__init__() chain and there is
+  no shared state to reset between tests.
+  """
   # pylint: disable=R0201
   # pylint: disable=W0613
 
@@ -140,10 +167,8 @@ class FakeGomaEnv(object):
 
   def ControlCompilerProxy(self, command, check_running=True, need_pids=False):
     if command == '/healthz':
-      return {'status': True, 'message': 'ok', 'url': 'dummy_url',
-              'pid': 'unknown'}
-    return {'status': True, 'message': 'dummy', 'url': 'dummy_url',
-            'pid': 'unknown'}
+      return _CCP_REPLY_HEALTHY
+    return _CCP_REPLY_DUMMY
 
   def CompilerProxyRunning(self):
     return True
@@ -284,6 +309,25 @@ class FakeGomaBackend(object):
     return {}
 
 
+class SpyControlCompilerProxyGomaEnv(FakeGomaEnv):
+  """Spy GomaEnv to capture ControlCompilerProxy command.
+
+  Defined at module scope so the class is created once per test run
+  instead of once per test method.
+  """
+
+  __slots__ = ('command',)
+
+  def __init__(self):
+    super(SpyControlCompilerProxyGomaEnv, self).__init__()
+    self.command = ''
+
+  def ControlCompilerProxy(self, command, check_running=True, need_pids=False):
+    self.command = command
+    return super(SpyControlCompilerProxyGomaEnv, self).ControlCompilerProxy(
+        command, check_running, need_pids)
+
+
 def _ClearGomaEnv():
   """Clear goma-related environmental variables."""
   to_delete = []
@@ -302,6 +346,13 @@ def _ClearGomaEnv():
 
 class GomaCtlTestCommon(unittest.TestCase):
   """Common features for goma_ctl.py test."""
+
+  @classmethod
+  def setUpClass(cls):
+    # FakeGomaBackend is stateless, so one instance is shared by all
+    # tests in a class instead of constructing it per test.
+    cls._backend = FakeGomaBackend()
+
   # test should be able to access protected members and variables.
   # pylint: disable=W0212
 
@@ -323,6 +374,9 @@ class GomaCtlTestCommon(unittest.TestCase):
     self._platform_specific = platform_specific
 
   def setUp(self):
+    # Take a snapshot of os.environ to restore it in tearDown instead of
+    # tracking and reverting each mutation done by a test.
+    self._orig_environ = os.environ.copy()
     _ClearGomaEnv()
 
     # suppress stdout and make it available from test.
@@ -343,9 +397,12 @@ class GomaCtlTestCommon(unittest.TestCase):
                                    os.path.join(self._tmp_dir,
                                                 self._TMP_SUBDIR_NAME,
                                                 _GOMA_CTL))
+    # Bind the driver factory once; tests instantiate it a lot.
+    self._Driver = self._module.GomaDriver
 
   def tearDown(self):
-    _ClearGomaEnv()
+    os.environ.clear()
+    os.environ.update(self._orig_environ)
     shutil.rmtree(self._tmp_dir)
 
 
@@ -364,20 +421,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
     self._module._COOLDOWN_SLEEP = 0
 
   def CreateSpyControlCompilerProxy(self):
-    class SpyGomaEnv(FakeGomaEnv):
-      """Spy GomaEnv to capture ControlCompilerProxy command."""
-
-      def __init__(self):
-        super(SpyGomaEnv, self).__init__()
-        self.command = ''
-
-      def ControlCompilerProxy(self, command, check_running=True,
-                               need_pids=False):
-        self.command = command
-        return super(SpyGomaEnv, self).ControlCompilerProxy(command,
-                                                            check_running,
-                                                            need_pids)
-    return SpyGomaEnv()
+    return SpyControlCompilerProxyGomaEnv()
 
   def testIsGomaFlagTrueShouldShowTrueForVariousTruePatterns(self):
     flag_test_name = 'FLAG_TEST'
@@ -415,10 +459,10 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
   def testSetGomaFlagDefaultValueIfEmptyShouldSetIfEmpty(self):
     flag_test_name = 'FLAG_TEST'
     flag_test_value = 'test'
-    self.assertFalse(('GOMA_%s' % flag_test_name) in os.environ)
+    self.assertNotIn('GOMA_%s' % flag_test_name, os.environ)
     self._module._SetGomaFlagDefaultValueIfEmpty(flag_test_name,
                                                  flag_test_value)
-    self.assertTrue(('GOMA_%s' % flag_test_name) in os.environ)
+    self.assertIn('GOMA_%s' % flag_test_name, os.environ)
     self.assertEqual(os.environ['GOMA_%s' % flag_test_name], flag_test_value)
 
   def testSetGomaFlagDefaultValueIfEmptyShouldNotSetIfNotEmpty(self):
@@ -436,33 +480,33 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
   def testParseManifestContentsShouldParseOneLine(self):
     parsed = self._module._ParseManifestContents('key=val')
     self.assertEqual(len(parsed), 1)
-    self.assertTrue('key' in parsed)
+    self.assertIn('key', parsed)
     self.assertEqual(parsed['key'], 'val')
 
   def testParseManifestContentsShouldParseMultipleLines(self):
     parsed = self._module._ParseManifestContents('key0=val0\nkey1=val1')
     self.assertEqual(len(parsed), 2)
-    self.assertTrue('key0' in parsed)
+    self.assertIn('key0', parsed)
     self.assertEqual(parsed['key0'], 'val0')
-    self.assertTrue('key1' in parsed)
+    self.assertIn('key1', parsed)
     self.assertEqual(parsed['key1'], 'val1')
 
   def testParseManifestContentsShouldShowEmptyValueIfEndWithEqual(self):
     parsed = self._module._ParseManifestContents('key=')
     self.assertEqual(len(parsed), 1)
-    self.assertTrue('key' in parsed)
+    self.assertIn('key', parsed)
     self.assertEqual(parsed['key'], '')
 
   def testParseManifestContentsShouldParseLineWithMultipleEquals(self):
     parsed = self._module._ParseManifestContents('key=label=value')
     self.assertEqual(len(parsed), 1)
-    self.assertTrue('key' in parsed)
+    self.assertIn('key', parsed)
     self.assertEqual(parsed['key'], 'label=value')
 
   def testParseManifestContentsShouldIgnoreLineWitoutEquals(self):
     parsed = self._module._ParseManifestContents('key')
     self.assertEqual(len(parsed), 0)
-    self.assertFalse('key' in parsed)
+    self.assertNotIn('key', parsed)
 
   def testIsBadVersionReturnsFalseForEmptyBadVersion(self):
     self.assertFalse(self._module._IsBadVersion(1, ''))
@@ -706,17 +750,16 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
     self.assertFalse(self._module._IsGomaFlagUpdated({}))
 
   def testIsGomaFlagUpdatedShouldReturnTrueIfNewFlag(self):
-    os.environ['GOMA_TEST'] = 'test'
-    self.assertTrue(self._module._IsGomaFlagUpdated({}))
+    with mock.patch.dict(os.environ, {'GOMA_TEST': 'test'}):
+      self.assertTrue(self._module._IsGomaFlagUpdated({}))
 
   def testIsGomaFlagUpdatedShouldReturnTrueIfFlagRemoved(self):
     self.assertTrue(self._module._IsGomaFlagUpdated({'GOMA_TEST': 'test'}))
 
   def testIsGomaFlagUpdatedShouldReturnFalseIfNoUpdate(self):
     expected = {'GOMA_TEST': 'test'}
-    for key, value in expected.items():
-      os.environ[key] = value
-    self.assertFalse(self._module._IsGomaFlagUpdated(expected))
+    with mock.patch.dict(os.environ, expected):
+      self.assertFalse(self._module._IsGomaFlagUpdated(expected))
 
   def testPullShouldUpdateManifestInLatestDir(self):
     class SpyGomaEnv(FakeGomaEnv):
@@ -746,7 +789,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         self.written_manifest = manifest
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._Pull()
     self.assertTrue(env.written_manifest)
     self.assertEqual(env.written_manifest['PLATFORM'], 'fake')
@@ -780,7 +823,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         self.written_manifest = manifest
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._Pull()
     self.assertTrue(env.written_manifest)
     self.assertEqual(env.written_manifest['PLATFORM'], 'fake')
@@ -803,7 +846,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         self.writte_manifest = True
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._Pull()
     self.assertTrue(env.is_valid_magic)
     self.assertTrue(env.writte_manifest)
@@ -838,7 +881,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         self.writte_manifest = True
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._Pull()
     self.assertTrue(env.read_manifest_latest)
     self.assertTrue(env.writte_manifest)
@@ -870,143 +913,68 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         self.writte_manifest = True
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._Pull()
     self.assertTrue(env.read_manifest_latest)
     self.assertTrue(env.writte_manifest)
 
   def testStartCompilerProxyShouldRun(self):
-    driver = self._module.GomaDriver(FakeGomaEnv(), FakeGomaBackend())
+    driver = self._Driver(FakeGomaEnv(), self._backend)
     driver._StartCompilerProxy()
 
   def testGetStatusShouldCallControlCompilerProxyWithHealthz(self):
     env = self.CreateSpyControlCompilerProxy()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._GetStatus()
     self.assertEqual(env.command, '/healthz')
 
   def testShutdownCompilerProxyShouldCallControlCompilerProxyWith3Quit(self):
     env = self.CreateSpyControlCompilerProxy()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._ShutdownCompilerProxy()
     self.assertEqual(env.command, '/quitquitquit')
 
   def testPrintStatisticsShouldCallControlCompilerProxyWithStatz(self):
     env = self.CreateSpyControlCompilerProxy()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._PrintStatistics()
     self.assertEqual(env.command, '/statz')
 
   def testPrintHistogramShouldCallControlCompilerProxyWithStatz(self):
     env = self.CreateSpyControlCompilerProxy()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._PrintHistogram()
     self.assertEqual(env.command, '/histogramz')
 
   def testGetJsonStatusShouldCallControlCompilerProxyWithErrorz(self):
     env = self.CreateSpyControlCompilerProxy()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._GetJsonStatus()
     self.assertEqual(env.command, '/errorz')
 
   def testPrintLatestVersionShouldRun(self):
-    driver = self._module.GomaDriver(FakeGomaEnv(), FakeGomaBackend())
+    driver = self._Driver(FakeGomaEnv(), self._backend)
     driver._PrintLatestVersion()
 
   def testReportMakeTgz(self):
-    class SpyGomaEnv(FakeGomaEnv):
-      """Spy GomaEnv to provide WriteFile, CopyFile and MakeTgzFromDirectory"""
-
-      def __init__(self):
-        super(SpyGomaEnv, self).__init__()
-        self.output_files = []
-        self.tgz_source_dir = None
-        self.tgz_file = None
-        self.written = False
-        self.find_latest_info_file = False
-
-      def WriteFile(self, filename, content):
-        self.output_files.append(filename)
-
-      def CopyFile(self, from_file, to_file):
-        self.output_files.append(to_file)
-
-      @staticmethod
-      def FindLatestLogFile(command_name, log_type):
-        return None
-
-      def MakeTgzFromDirectory(self, dir_name, output_filename):
-        self.tgz_source_dir = dir_name
-        self.tgz_file = output_filename
-        self.written = True
-
-    env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
-    driver._Report()
-    self.assertTrue(env.written)
-    for f in env.output_files:
-      self.assertTrue(f.startswith(env.tgz_source_dir))
-    self.assertTrue(env.tgz_file.startswith(self._module._GetTempDirectory()))
-
-  def testReportMakeTgzWithoutCompilerProxyRunning(self):
     class SpyGomaEnv(FakeGomaEnv):
       """Spy GomaEnv to provide WriteFile, CopyFile and MakeTgzFromDirectory.
-         Also, compiler_proxy is not running in this env."""
-
-      def __init__(self):
-        super(SpyGomaEnv, self).__init__()
-        self.output_files = []
-        self.tgz_source_dir = None
-        self.tgz_file = None
-        self.written = False
-
-      def ControlCompilerProxy(self, command, check_running=False,
-                               need_pids=False):
-        if command == '/healthz':
-          return {
-              'status': False,
-              'message': 'compiler proxy is not running',
-              'url': 'fake',
-              'pid': 'unknown',
-          }
-        # /compilerz, /histogramz, /serverz, or /statz won't be called.
-        if command in ['/compilerz', '/histogramz', '/serverz', '/statz']:
-          raise Exception('Unexpected command is called')
-        return super(SpyGomaEnv, self).ControlCompilerProxy(command,
-                                                            check_running,
-                                                            need_pids)
 
-      def WriteFile(self, filename, content):
-        self.output_files.append(filename)
-
-      def CopyFile(self, from_file, to_file):
-        self.output_files.append(to_file)
+      healthz_mode parameterizes how /healthz behaves:
+        'healthy': compiler_proxy is working.
+        'not_running': compiler proxy is not running from the beginning.
+        'dead_after_healthz': dies after the first /healthz call.
+      """
 
-      @staticmethod
-      def FindLatestLogFile(command_name, log_type):
-        return None
+      __slots__ = ('_healthz_mode', '_super_ccp', 'output_files',
+                   'tgz_source_dir', 'tgz_file', 'written', 'is_dead')
 
-      def MakeTgzFromDirectory(self, dir_name, output_filename):
-        self.tgz_source_dir = dir_name
-        self.tgz_file = output_filename
-        self.written = True
-
-    env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
-    driver._Report()
-    self.assertTrue(env.written)
-    for f in env.output_files:
-      self.assertTrue(f.startswith(env.tgz_source_dir))
-    self.assertTrue(env.tgz_file.startswith(self._module._GetTempDirectory()))
-
-  def testReportMakeTgzCompilerProxyDeadAfterHealthz(self):
-    class SpyGomaEnv(FakeGomaEnv):
-      """Spy GomaEnv to provide WriteFile, CopyFile and MakeTgzFromDirectory.
-         compiler_proxy dies after the first /healthz call."""
-
-      def __init__(self):
+      def __init__(self, healthz_mode):
         super(SpyGomaEnv, self).__init__()
-        self.output_files = []
+        self._healthz_mode = healthz_mode
+        # Bind the parent implementation once to avoid per-call MRO lookup.
+        self._super_ccp = super(SpyGomaEnv, self).ControlCompilerProxy
+        self.output_files = collections.deque()
         self.tgz_source_dir = None
         self.tgz_file = None
         self.written = False
@@ -1014,20 +982,30 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
 
       def ControlCompilerProxy(self, command, check_running=False,
                                need_pids=False):
-        if self.is_dead:
-          return {
-              'status': False,
-              'message': 'compiler_proxy is not running',
-              'url': 'dummy',
-              'pid': 'unknown',
-          }
-        # Die after /healthz is called. The first /healthz should be
-        # processed correctly.
-        if command == '/healthz':
-          self.is_dead = True
-        return super(SpyGomaEnv, self).ControlCompilerProxy(command,
-                                                            check_running,
-                                                            need_pids)
+        if self._healthz_mode == 'not_running':
+          if command == '/healthz':
+            return {
+                'status': False,
+                'message': 'compiler proxy is not running',
+                'url': 'fake',
+                'pid': 'unknown',
+            }
+          # /compilerz, /histogramz, /serverz, or /statz won't be called.
+          if command in ['/compilerz', '/histogramz', '/serverz', '/statz']:
+            raise Exception('Unexpected command is called')
+        elif self._healthz_mode == 'dead_after_healthz':
+          if self.is_dead:
+            return {
+                'status': False,
+                'message': 'compiler_proxy is not running',
+                'url': 'dummy',
+                'pid': 'unknown',
+            }
+          # Die after /healthz is called. The first /healthz should be
+          # processed correctly.
+          if command == '/healthz':
+            self.is_dead = True
+        return self._super_ccp(command, check_running, need_pids)
 
       def WriteFile(self, filename, content):
         self.output_files.append(filename)
@@ -1044,13 +1022,16 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         self.tgz_file = output_filename
         self.written = True
 
-    env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
-    driver._Report()
-    self.assertTrue(env.written)
-    for f in env.output_files:
-      self.assertTrue(f.startswith(env.tgz_source_dir))
-    self.assertTrue(env.tgz_file.startswith(self._module._GetTempDirectory()))
+    for healthz_mode in ('healthy', 'not_running', 'dead_after_healthz'):
+      env = SpyGomaEnv(healthz_mode)
+      driver = self._Driver(env, self._backend)
+      driver._Report()
+      self.assertTrue(env.written, msg=healthz_mode)
+      for f in env.output_files:
+        self.assertTrue(f.startswith(env.tgz_source_dir), msg=healthz_mode)
+      self.assertTrue(
+          env.tgz_file.startswith(self._module._GetTempDirectory()),
+          msg=healthz_mode)
 
   def testAutoUpdate(self):
     class SpyGomaEnv(FakeGomaEnv):
@@ -1081,7 +1062,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         self.auto_updated = True
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._StartCompilerProxy()
     self.assertTrue(env.auto_updated)
     self.assertTrue(env.read_manifest_before_update)
@@ -1091,55 +1072,28 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
     self.assertEqual(driver._version, 2)
 
   def testShouldNotAutoUpdateIfAlreadyUpToDate(self):
-    class SpyGomaEnv(FakeGomaEnv):
-      def __init__(self):
-        super(SpyGomaEnv, self).__init__()
-        self.auto_updated = False
-        self.http_downloaded = False
-
-      def HttpDownload(self, url,
-                       rewrite_url=None, headers=None, destination_file=None):
-        self.http_downloaded = True
-        return 'VERSION=1'
-
-      def CanAutoUpdate(self):
-        return True
-
-      def ReadManifest(self, _=None):
-        return {'VERSION': '1'}
-
-      def AutoUpdate(self):
-        self.auto_updated = True
-
-    env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
-    driver._StartCompilerProxy()
-    self.assertTrue(env.http_downloaded)
-    self.assertFalse(env.auto_updated)
+    env = FakeGomaEnv()
+    with mock.patch.object(
+        env, 'HttpDownload', return_value='VERSION=1') as http_download, \
+        mock.patch.object(
+            env, 'ReadManifest', return_value={'VERSION': '1'}), \
+        mock.patch.object(env, 'AutoUpdate') as auto_update:
+      driver = self._Driver(env, self._backend)
+      driver._StartCompilerProxy()
+    self.assertTrue(http_download.called)
+    self.assertFalse(auto_update.called)
 
   def testShouldNotAutoUpdateIfCanAutoUpdateIsFalse(self):
-    class SpyGomaEnv(FakeGomaEnv):
-      def __init__(self):
-        super(SpyGomaEnv, self).__init__()
-        self.auto_updated = False
-        self.http_downloaded = False
-
-      def HttpDownload(self, url,
-                       rewrite_url=None, headers=None, destination_file=None):
-        self.http_downloaded = True
-        return 'VERSION=1'
-
-      def CanAutoUpdate(self):
-        return False
-
-      def AutoUpdate(self):
-        self.auto_updated = True
-
-    env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
-    driver._StartCompilerProxy()
-    self.assertFalse(env.http_downloaded)
-    self.assertFalse(env.auto_updated)
+    env = FakeGomaEnv()
+    with mock.patch.object(
+        env, 'CanAutoUpdate', return_value=False) as can_auto_update, \
+        mock.patch.object(env, 'HttpDownload') as http_download, \
+        mock.patch.object(env, 'AutoUpdate') as auto_update:
+      driver = self._Driver(env, self._backend)
+      driver._StartCompilerProxy()
+    self.assertTrue(can_auto_update.called)
+    self.assertFalse(http_download.called)
+    self.assertFalse(auto_update.called)
 
   def testUpdateShouldUpdateIfFindTheNewVersion(self):
     class SpyGomaEnv(FakeGomaEnv):
@@ -1159,7 +1113,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         return True  # install success.
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._Update()
     self.assertTrue(env.http_downloaded)
     self.assertTrue(env.install_package)
@@ -1185,7 +1139,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         return True  # install success.
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._Update()
     self.assertTrue(env.http_downloaded)
     self.assertFalse(env.install_package)
@@ -1219,7 +1173,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         return True  # install success.
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._Update()
     self.assertTrue(env.http_downloaded)
     self.assertFalse(env.install_package)
@@ -1253,7 +1207,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         return True  # install success.
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._Update()
     self.assertTrue(env.http_downloaded)
     self.assertTrue(env.install_package)
@@ -1287,7 +1241,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         return True  # install success.
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._Update()
     self.assertTrue(env.http_downloaded)
     self.assertTrue(env.install_package)
@@ -1321,7 +1275,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         return True  # install success.
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._Update()
     self.assertTrue(env.http_downloaded)
     self.assertTrue(env.install_package)
@@ -1359,7 +1313,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         return 'invalid'  # wrong checksum.
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     self.assertRaises(self._module.Error, driver._Update)
     self.assertTrue(env.http_downloaded)
     self.assertTrue(env.load_checksum)
@@ -1387,7 +1341,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         return False  # install failure.
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     self.assertRaises(self._module.Error, driver._Update)
     self.assertTrue(env.http_downloaded)
     self.assertTrue(env.install_package)
@@ -1424,7 +1378,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         self.exec_compiler_proxy = True
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._Update()
     self.assertTrue(env.http_downloaded)
     self.assertTrue(env.installed_before)
@@ -1461,7 +1415,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         self.exec_compiler_proxy = True
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._Update()
     self.assertTrue(env.http_downloaded)
     self.assertTrue(env.compiler_proxy_running)
@@ -1499,7 +1453,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         return True
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._UpdatePackage()
     self.assertTrue(env.read_manifest)
     self.assertTrue(env.is_installed_before)
@@ -1507,7 +1461,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
     self.assertTrue(env.install_package)
 
   def testRestartCompilerProxyShouldRun(self):
-    driver = self._module.GomaDriver(FakeGomaEnv(), FakeGomaBackend())
+    driver = self._Driver(FakeGomaEnv(), self._backend)
     driver._RestartCompilerProxy()
 
   def testEnsureStartShouldStartCompilerProxy(self):
@@ -1530,7 +1484,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         self.exec_compiler_proxy = True
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._EnsureStartCompilerProxy()
     self.assertTrue(env.can_auto_update)
     self.assertTrue(env.compiler_proxy_running)
@@ -1552,7 +1506,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
                                                             need_pids)
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     self.assertTrue(driver._GetStatus())
     self.assertTrue(env.compiler_proxy_healthz_called)
 
@@ -1572,7 +1526,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
                                                             need_pids)
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     self.assertTrue(driver._GetStatus())
     self.assertTrue(env.compiler_proxy_healthz_called)
 
@@ -1592,7 +1546,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
                                                             need_pids)
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     self.assertFalse(driver._GetStatus())
     self.assertTrue(env.compiler_proxy_healthz_called)
 
@@ -1612,7 +1566,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
                                                             need_pids)
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     self.assertFalse(driver._GetStatus())
     self.assertTrue(env.compiler_proxy_healthz_called)
 
@@ -1652,8 +1606,10 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
                                need_pids=False):
         if command == '/quitquitquit':
           self.control_with_quit = True
+          return _CCP_REPLY_DUMMY
         elif command == '/healthz':
           self.control_with_health = True
+          return _CCP_REPLY_HEALTHY
         elif command == '/versionz':
           self.control_with_version = True
           return {'status': True, 'message': 'dummy_version', 'url': 'fake',
@@ -1662,12 +1618,9 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
           return {'status': True, 'message': '', 'pid': 'unknown'}
         else:
           raise Exception('Unknown command given.')
-        return super(SpyGomaEnv, self).ControlCompilerProxy(command,
-                                                            check_running,
-                                                            need_pids)
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._EnsureStartCompilerProxy()
     self.assertFalse(env.using_default)
     self.assertFalse(env.kill_all)
@@ -1678,6 +1631,32 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
     self.assertTrue(env.control_with_version)
     self.assertFalse(env.control_with_quit)
 
+  def testEnsureStartShouldSkipChecksWithinTTL(self):
+    class SpyGomaEnv(FakeGomaEnv):
+      """Spy GomaEnv to count ControlCompilerProxy calls."""
+
+      __slots__ = ('control_compiler_proxy_count',)
+
+      def __init__(self):
+        super(SpyGomaEnv, self).__init__()
+        self.control_compiler_proxy_count = 0
+
+      def ControlCompilerProxy(self, command, check_running=True,
+                               need_pids=False):
+        self.control_compiler_proxy_count += 1
+        return super(SpyGomaEnv, self).ControlCompilerProxy(command,
+                                                            check_running,
+                                                            need_pids)
+
+    env = SpyGomaEnv()
+    driver = self._Driver(env, self._backend)
+    driver._EnsureStartCompilerProxy()
+    count_after_first = env.control_compiler_proxy_count
+    self.assertTrue(count_after_first > 0)
+    # A repeated ensure_start within the TTL does no proxy IPC.
+    driver._EnsureStartCompilerProxy()
+    self.assertEqual(env.control_compiler_proxy_count, count_after_first)
+
   def testEnsureStartShouldUpdateCompilerProxy(self):
     class SpyGomaEnv(FakeGomaEnv):
       def __init__(self):
@@ -1704,7 +1683,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         self.auto_update = True
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._EnsureStartCompilerProxy()
     self.assertTrue(env.can_auto_update)
     self.assertTrue(env.read_manifest)
@@ -1740,7 +1719,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         self.auto_update = True
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._EnsureStartCompilerProxy()
     self.assertTrue(env.can_auto_update)
     self.assertTrue(env.read_manifest)
@@ -1781,7 +1760,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         self.auto_update = True
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._EnsureStartCompilerProxy()
     self.assertTrue(env.can_auto_update)
     self.assertTrue(env.read_manifest)
@@ -1823,7 +1802,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         self.auto_update = True
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._EnsureStartCompilerProxy()
     self.assertTrue(env.can_auto_update)
     self.assertTrue(env.read_manifest)
@@ -1855,8 +1834,10 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
                                need_pids=False):
         if command == '/quitquitquit':
           self.control_with_quit = True
+          return _CCP_REPLY_DUMMY
         elif command == '/healthz':
           self.control_with_health = True
+          return _CCP_REPLY_HEALTHY
         elif command == '/versionz':
           self.control_with_version = True
         elif command == '/flagz':
@@ -1871,7 +1852,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         self.kill_stakeholders = True
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._EnsureStartCompilerProxy()
     self.assertTrue(env.compiler_proxy_running)
     self.assertTrue(env.get_version)
@@ -1906,6 +1887,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
                                need_pids=False):
         if command == '/quitquitquit':
           self.control_with_quit = True
+          return _CCP_REPLY_DUMMY
         elif command == '/healthz':
           self.control_with_health = True
           if self.status_healthy:
@@ -1927,9 +1909,6 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
           return {'status': True, 'message': ''}
         else:
           raise Exception('Unknown command given.')
-        return super(SpyGomaEnv, self).ControlCompilerProxy(command,
-                                                            check_running,
-                                                            need_pids)
 
       def KillStakeholders(self, force=False):
         self.kill_stakeholders = True
@@ -1941,7 +1920,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         self.status_healthy = True
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._EnsureStartCompilerProxy()
     self.assertTrue(env.compiler_proxy_running)
     self.assertTrue(env.get_version)
@@ -1971,44 +1950,72 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         self.get_version = True
         return 'GOMA version dummy_version'
 
-      def ControlCompilerProxy(self, command, check_running=False,
-                               need_pids=False):
-        if command == '/quitquitquit':
-          self.control_with_quit = True
-        elif command == '/healthz':
-          self.control_with_health = True
-          return {'status': True,
-                  'message': 'ok',
-                  'url': 'dummy',
-                  'pid': 'unknown',
-                  }
-        elif command == '/versionz':
-          self.control_with_version = True
-          return {'status': True, 'message': 'dummy_version', 'url': 'fake',
-                  'pid': 'unknown'}
-        elif command == '/flagz':
-          self.control_with_flagz = True
-          return {'status': True, 'message': '', 'pid': 'unknown'}
-        else:
-          raise Exception('Unknown command given.')
+      def _HandleQuit(self, command, check_running, need_pids):
+        self.control_with_quit = True
         return super(SpyGomaEnv, self).ControlCompilerProxy(command,
                                                             check_running,
                                                             need_pids)
 
+      def _HandleHealthz(self, command, check_running, need_pids):
+        self.control_with_health = True
+        return {'status': True,
+                'message': 'ok',
+                'url': 'dummy',
+                'pid': 'unknown',
+                }
+
+      def _HandleVersionz(self, command, check_running, need_pids):
+        self.control_with_version = True
+        return {'status': True, 'message': 'dummy_version', 'url': 'fake',
+                'pid': 'unknown'}
+
+      def _HandleFlagz(self, command, check_running, need_pids):
+        self.control_with_flagz = True
+        return {'status': True, 'message': '', 'pid': 'unknown'}
+
+      # command to handler; one hash lookup instead of an if/elif chain.
+      _HANDLERS = {
+          '/quitquitquit': _HandleQuit,
+          '/healthz': _HandleHealthz,
+          '/versionz': _HandleVersionz,
+          '/flagz': _HandleFlagz,
+      }
+
+      def ControlCompilerProxy(self, command, check_running=False,
+                               need_pids=False):
+        handler = self._HANDLERS.get(command)
+        if handler is None:
+          raise Exception('Unknown command given.')
+        return handler(self, command, check_running, need_pids)
+
       def KillStakeholders(self, force=False):
         self.kill_stakeholders = True
 
-    os.environ['GOMA_TEST'] = 'flag should be different'
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
-    driver._EnsureStartCompilerProxy()
-    self.assertTrue(env.compiler_proxy_running)
-    self.assertTrue(env.get_version)
-    self.assertTrue(env.control_with_health)
-    self.assertTrue(env.control_with_version)
-    self.assertTrue(env.control_with_quit)
-    self.assertTrue(env.control_with_flagz)
-    self.assertTrue(env.kill_stakeholders)
+    driver = self._Driver(env, self._backend)
+    with mock.patch.dict(os.environ, {'GOMA_TEST': 'flag should be different'}):
+      driver._EnsureStartCompilerProxy()
+    # One dict compare instead of a wall of assertTrue; on failure the
+    # diff names every flag that did not flip.
+    self.assertEqual(
+        {
+            'compiler_proxy_running': env.compiler_proxy_running,
+            'get_version': env.get_version,
+            'control_with_health': env.control_with_health,
+            'control_with_version': env.control_with_version,
+            'control_with_quit': env.control_with_quit,
+            'control_with_flagz': env.control_with_flagz,
+            'kill_stakeholders': env.kill_stakeholders,
+        },
+        {
+            'compiler_proxy_running': True,
+            'get_version': True,
+            'control_with_health': True,
+            'control_with_version': True,
+            'control_with_quit': True,
+            'control_with_flagz': True,
+            'kill_stakeholders': True,
+        })
 
   def testEnsureStartShouldRestartIfFlagsAreRemoved(self):
     class SpyGomaEnv(FakeGomaEnv):
@@ -2034,6 +2041,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
                                need_pids=False):
         if command == '/quitquitquit':
           self.control_with_quit = True
+          return _CCP_REPLY_DUMMY
         elif command == '/healthz':
           self.control_with_health = True
           return {'status': True,
@@ -2051,23 +2059,34 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
                   'pid': 'unknown'}
         else:
           raise Exception('Unknown command given.')
-        return super(SpyGomaEnv, self).ControlCompilerProxy(command,
-                                                            check_running,
-                                                            need_pids)
 
       def KillStakeholders(self, force=False):
         self.kill_stakeholders = True
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._EnsureStartCompilerProxy()
-    self.assertTrue(env.compiler_proxy_running)
-    self.assertTrue(env.get_version)
-    self.assertTrue(env.control_with_health)
-    self.assertTrue(env.control_with_version)
-    self.assertTrue(env.control_with_quit)
-    self.assertTrue(env.control_with_flagz)
-    self.assertTrue(env.kill_stakeholders)
+    # One dict compare instead of a wall of assertTrue; on failure the
+    # diff names every flag that did not flip.
+    self.assertEqual(
+        {
+            'compiler_proxy_running': env.compiler_proxy_running,
+            'get_version': env.get_version,
+            'control_with_health': env.control_with_health,
+            'control_with_version': env.control_with_version,
+            'control_with_quit': env.control_with_quit,
+            'control_with_flagz': env.control_with_flagz,
+            'kill_stakeholders': env.kill_stakeholders,
+        },
+        {
+            'compiler_proxy_running': True,
+            'get_version': True,
+            'control_with_health': True,
+            'control_with_version': True,
+            'control_with_quit': True,
+            'control_with_flagz': True,
+            'kill_stakeholders': True,
+        })
 
   def testEnsureStartShouldNotRestartIfFlagsNotChanged(self):
     class SpyGomaEnv(FakeGomaEnv):
@@ -2093,6 +2112,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
                                need_pids=False):
         if command == '/quitquitquit':
           self.control_with_quit = True
+          return _CCP_REPLY_DUMMY
         elif command == '/healthz':
           self.control_with_health = True
           return {'status': True,
@@ -2109,15 +2129,12 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
           return {'status': True, 'message': '', 'pid': 'unknown'}
         else:
           raise Exception('Unknown command given.')
-        return super(SpyGomaEnv, self).ControlCompilerProxy(command,
-                                                            check_running,
-                                                            need_pids)
 
       def KillStakeholders(self, force=False):
         self.kill_stakeholders = True
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._EnsureStartCompilerProxy()
     self.assertTrue(env.compiler_proxy_running)
     self.assertTrue(env.get_version)
@@ -2150,6 +2167,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
                                need_pids=False):
         if command == '/quitquitquit':
           self.control_with_quit = True
+          return _CCP_REPLY_DUMMY
         elif command == '/healthz':
           self.control_with_health = True
           return {'status': True,
@@ -2165,15 +2183,12 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
           return {'status': True, 'message': '', 'pid': 'unknown'}
         else:
           raise Exception('Unknown command given.')
-        return super(SpyGomaEnv, self).ControlCompilerProxy(command,
-                                                            check_running,
-                                                            need_pids)
 
       def KillStakeholders(self, force=False):
         self.kill_stakeholders = True
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._EnsureStartCompilerProxy()
     self.assertTrue(env.compiler_proxy_running)
     self.assertTrue(env.get_version)
@@ -2191,7 +2206,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
                       'unknown_package_name')
 
   def testFetchShouldRun(self):
-    driver = self._module.GomaDriver(FakeGomaEnv(), FakeGomaBackend())
+    driver = self._Driver(FakeGomaEnv(), self._backend)
     driver._args = ['dummy', self._platform_specific.GetPlatform()]
     driver._Fetch()
 
@@ -2209,15 +2224,15 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
 
     output_file = 'TEST'
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._args = ['dummy', self._platform_specific.GetPlatform(), output_file]
     driver._Fetch()
     self.assertTrue(env.http_download)
-    self.assertTrue(output_file in env.dest,
-                    msg='Seems not output to specified file.')
+    self.assertIn(output_file, env.dest,
+                  msg='Seems not output to specified file.')
 
   def testFetchShouldRaiseIfPlatformNotGiven(self):
-    driver = self._module.GomaDriver(FakeGomaEnv(), FakeGomaBackend())
+    driver = self._Driver(FakeGomaEnv(), self._backend)
     self.assertRaises(self._module.ConfigError, driver._Fetch)
 
   def testIsCompilerProxySilentlyUpdatedShouldReturnTrueIfVersionMismatch(self):
@@ -2239,7 +2254,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
                   'pid': 'unknown'}
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     self.assertTrue(driver._IsCompilerProxySilentlyUpdated())
     self.assertTrue(env.get_version)
     self.assertTrue(env.control_with_version)
@@ -2263,7 +2278,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
                   'pid': 'unknown'}
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     self.assertFalse(driver._IsCompilerProxySilentlyUpdated())
     self.assertTrue(env.get_version)
     self.assertTrue(env.control_with_version)
@@ -2281,8 +2296,8 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
           return {'status': False, 'pid': 'unknown'}
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
-    printed_json = json.loads(driver._GetJsonStatus())
+    driver = self._Driver(env, self._backend)
+    printed_json = _json_loads(driver._GetJsonStatus())
     self.assertTrue(env.control_compiler_proxy)
     self.assertEqual(printed_json['notice'][0]['compile_error'],
                      'COMPILER_PROXY_UNREACHABLE')
@@ -2302,7 +2317,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
                   'pid': 'unknown'}
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     returned = driver._GetJsonStatus()
     self.assertTrue(env.control_compiler_proxy)
     self.assertEqual(returned, compiler_proxy_output)
@@ -2331,15 +2346,12 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         return True
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
-    orig_goma_tmp_dir = os.environ.get('GOMA_TMP_DIR')
-    self.assertNotEqual(orig_goma_tmp_dir, fake_tmpdir)
-    driver._CreateGomaTmpDirectory()
-    goma_tmp_dir = os.environ.get('GOMA_TMP_DIR')
-    if orig_goma_tmp_dir:
-      os.environ['GOMA_TMP_DIR'] = orig_goma_tmp_dir
-    else:
-      del os.environ['GOMA_TMP_DIR']
+    driver = self._Driver(env, self._backend)
+    self.assertNotEqual(_environ_get('GOMA_TMP_DIR'), fake_tmpdir)
+    # patch.dict restores GOMA_TMP_DIR even when an assertion fails.
+    with mock.patch.dict(os.environ):
+      driver._CreateGomaTmpDirectory()
+      goma_tmp_dir = _environ_get('GOMA_TMP_DIR')
     self.assertEqual(env.is_directory_exist, fake_tmpdir)
     self.assertEqual(env.make_directory, fake_tmpdir)
     self.assertEqual(env.ensure_directory_owned_by_user, None)
@@ -2369,15 +2381,11 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         return True
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
-    orig_goma_tmp_dir = os.environ.get('GOMA_TMP_DIR')
-    self.assertNotEqual(orig_goma_tmp_dir, fake_tmpdir)
-    driver._CreateGomaTmpDirectory()
-    goma_tmp_dir = os.environ.get('GOMA_TMP_DIR')
-    if orig_goma_tmp_dir:
-      os.environ['GOMA_TMP_DIR'] = orig_goma_tmp_dir
-    else:
-      del os.environ['GOMA_TMP_DIR']
+    driver = self._Driver(env, self._backend)
+    self.assertNotEqual(_environ_get('GOMA_TMP_DIR'), fake_tmpdir)
+    with mock.patch.dict(os.environ):
+      driver._CreateGomaTmpDirectory()
+      goma_tmp_dir = _environ_get('GOMA_TMP_DIR')
     self.assertEqual(env.is_directory_exist, fake_tmpdir)
     self.assertEqual(env.make_directory, None)
     self.assertEqual(env.ensure_directory_owned_by_user, fake_tmpdir)
@@ -2417,7 +2425,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         return True
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._CreateCrashDumpDirectory()
     self.assertTrue(env.get_crash_dump_directory)
     self.assertTrue(env.is_directory_exist)
@@ -2459,7 +2467,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         return True
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._CreateCrashDumpDirectory()
     self.assertTrue(env.get_crash_dump_directory)
     self.assertTrue(env.is_directory_exist)
@@ -2501,7 +2509,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         return True
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._CreateCacheDirectory()
     self.assertTrue(env.get_cache_directory)
     self.assertTrue(env.is_directory_exist)
@@ -2544,7 +2552,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         return True
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     driver._CreateCacheDirectory()
     self.assertTrue(env.get_cache_directory)
     self.assertTrue(env.is_directory_exist)
@@ -2569,7 +2577,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         return True
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     self.assertFalse(driver._ValidFiles(['test', 'wrong_magic']))
     self.assertTrue(env.is_valid_magic)
 
@@ -2588,7 +2596,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         self.calculate_checksum = True
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     self.assertTrue(driver._Audit())
     self.assertTrue(env.load_checksum)
     self.assertFalse(env.calculate_checksum)
@@ -2610,7 +2618,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         return 'valid_checksum'
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     self.assertTrue(driver._Audit())
     self.assertTrue(env.load_checksum)
     self.assertTrue(env.calculate_checksum)
@@ -2632,7 +2640,7 @@ class GomaCtlSmallTest(GomaCtlTestCommon):
         return 'invalid_checksum'
 
     env = SpyGomaEnv()
-    driver = self._module.GomaDriver(env, FakeGomaBackend())
+    driver = self._Driver(env, self._backend)
     self.assertFalse(driver._Audit())
     self.assertTrue(env.load_checksum)
     self.assertTrue(env.calculate_checksum)
@@ -2646,6 +2654,17 @@ class GomaEnvTest(GomaCtlTestCommon):
   # test should be able to access protected members and variables.
   # pylint: disable=W0212
 
+  # GomaEnv construction re-reads environment, MANIFEST, and proxy settings.
+  # Tests that do not depend on per-test state share one instance, built
+  # lazily in setUp because the module itself is loaded per test.
+  _shared_env = None
+
+  def setUp(self):
+    super(GomaEnvTest, self).setUp()
+    if GomaEnvTest._shared_env is None:
+      GomaEnvTest._shared_env = self._module._GOMA_ENVS[os.name]()
+    self._shared_env = GomaEnvTest._shared_env
+
   def testBackupCurrentPackageShouldCreateBackup(self):
     env = self._module.GomaEnv()
     env.BackupCurrentPackage()
@@ -2660,46 +2679,44 @@ class GomaEnvTest(GomaCtlTestCommon):
     dummy_goma_ctl_path = os.path.join(env._dir, 'backup', 'goma_ctl.py')
     with open(dummy_goma_ctl_path, 'w') as f:
       f.write(dummy_data)
-    self.assertEqual(open(dummy_goma_ctl_path).read(), dummy_data)
+    self.assertEqual(_Slurp(dummy_goma_ctl_path), dummy_data)
     env.BackupCurrentPackage()
     self.assertTrue(os.path.isfile(dummy_goma_ctl_path))
-    self.assertNotEqual(open(dummy_goma_ctl_path).read(), dummy_data)
+    self.assertNotEqual(_Slurp(dummy_goma_ctl_path), dummy_data)
 
   def testRollbackShouldRollbackUpdate(self):
     env = self._module.GomaEnv()
-    test_file_tuple = tempfile.mkstemp(dir=env._dir)
-    os.close(test_file_tuple[0])
-    test_file = test_file_tuple[1]
-    with open(test_file, 'w') as f:
+    with tempfile.NamedTemporaryFile(mode='w', delete=False,
+                                     dir=env._dir) as f:
       f.write('before')
+      test_file = f.name
     self.assertTrue(os.path.isfile(test_file))
     env.BackupCurrentPackage()
     with open(os.path.join(env._dir, test_file), 'w') as f:
       f.write('after')
-    self.assertEqual(open(test_file).read(), 'after')
+    self.assertEqual(_Slurp(test_file), 'after')
     env.RollbackUpdate()
-    self.assertEqual(open(test_file).read(), 'before')
+    self.assertEqual(_Slurp(test_file), 'before')
 
   def testRollbackShouldRollbackVeryLongFileName(self):
     env = self._module.GomaEnv()
     long_suffix = '.' + 'Aa0-' * 16
     long_prefix = 'Aa0-' * 16
     # File name should be at least 128 charactors.
-    test_file_tuple = tempfile.mkstemp(suffix=long_suffix, prefix=long_prefix,
-                                       dir=env._dir)
-    os.close(test_file_tuple[0])
-    test_file = test_file_tuple[1]
+    with tempfile.NamedTemporaryFile(mode='w', delete=False,
+                                     suffix=long_suffix, prefix=long_prefix,
+                                     dir=env._dir) as f:
+      f.write('before')
+      test_file = f.name
     self.assertTrue(len(test_file) > 128,
                     msg='assuming at least 128 charactors filename.')
-    with open(test_file, 'w') as f:
-      f.write('before')
     self.assertTrue(os.path.isfile(test_file))
     env.BackupCurrentPackage()
     with open(os.path.join(env._dir, test_file), 'w') as f:
       f.write('after')
-    self.assertEqual(open(test_file).read(), 'after')
+    self.assertEqual(_Slurp(test_file), 'after')
     env.RollbackUpdate()
-    self.assertEqual(open(test_file).read(), 'before')
+    self.assertEqual(_Slurp(test_file), 'before')
 
   def testRollbackShouldNotDieEvenIfOriginalContainsDirectory(self):
     env = self._module.GomaEnv()
@@ -2785,7 +2802,7 @@ class GomaEnvTest(GomaCtlTestCommon):
     self.assertFalse(env.IsOldFile(filename))
 
   def testMakeDirectory(self):
-    env = self._module._GOMA_ENVS[os.name]()
+    env = self._shared_env
     tmpdir = tempfile.mkdtemp()
     os.rmdir(tmpdir)
     self.assertFalse(os.path.exists(tmpdir))
@@ -2799,7 +2816,7 @@ class GomaEnvTest(GomaCtlTestCommon):
 
   def testEnsureDirectoryOwnedByUser(self):
     tmpdir = tempfile.mkdtemp()
-    env = self._module._GOMA_ENVS[os.name]()
+    env = self._shared_env
     if os.name == 'nt':
       self.assertTrue(env.EnsureDirectoryOwnedByUser(tmpdir))
       os.rmdir(tmpdir)
@@ -2822,26 +2839,19 @@ class GomaEnvTest(GomaCtlTestCommon):
     expected_cache_dir = os.path.join(
         fake_tmp_dir, self._module._CACHE_DIR)
 
-    env = self._module._GOMA_ENVS[os.name]()
-    env.GetGomaTmpDir = lambda: fake_tmp_dir
-    self.assertEqual(env.GetCacheDirectory(), expected_cache_dir)
+    env = self._shared_env
+    with mock.patch.object(env, 'GetGomaTmpDir', lambda: fake_tmp_dir):
+      self.assertEqual(env.GetCacheDirectory(), expected_cache_dir)
 
   def testCreateCacheDirectoryShouldRespectCacheDirEnv(self):
     fake_tmp_dir = '/fake_tmp'
     fake_cache_dir = '/fake_cache_dir'
     expected_cache_dir = fake_cache_dir
 
-    env = self._module._GOMA_ENVS[os.name]()
-    env.GetGomaTmpDir = lambda: fake_tmp_dir
-    try:
-      backup = os.environ.get('GOMA_CACHE_DIR')
-      os.environ['GOMA_CACHE_DIR'] = fake_cache_dir
-      self.assertEqual(env.GetCacheDirectory(), expected_cache_dir)
-    finally:
-      if backup:
-        os.environ['GOMA_CACHE_DIR'] = backup
-      else:
-        del os.environ['GOMA_CACHE_DIR']
+    env = self._shared_env
+    with mock.patch.object(env, 'GetGomaTmpDir', lambda: fake_tmp_dir):
+      with mock.patch.dict(os.environ, {'GOMA_CACHE_DIR': fake_cache_dir}):
+        self.assertEqual(env.GetCacheDirectory(), expected_cache_dir)
 
   def testShouldFallbackGomaUsernameNoEnvIfNoEnvSet(self):
     self._module._GetUsernameEnv = lambda: ''
@@ -2858,6 +2868,10 @@ class GomaCtlLargeTestCommon(GomaCtlTestCommon):
   # test should be able to access protected members and variables.
   # pylint: disable=W0212
 
+  # Supported platform list; invariant across tests, so computed once from
+  # the first loaded module.
+  _ALL_PLATFORMS = None
+
   def __init__(self, method_name, goma_ctl_path, platform_specific,
                oauth2_file, port):
     """Initialize GomaCtlTest.
@@ -2879,8 +2893,22 @@ class GomaCtlLargeTestCommon(GomaCtlTestCommon):
     super(GomaCtlLargeTestCommon, self).setUp()
     self._platform_specific.SetCompilerProxyEnv(self._tmp_dir, self._port)
 
+  def _CompilerProxyMtime(self, env):
+    """Returns mtime of the compiler_proxy binary in the test goma dir.
+
+    Args:
+      env: a GomaEnv instance to ask the binary name.
+
+    Returns:
+      mtime of the binary as float.
+    """
+    return os.path.getmtime(os.path.join(self._tmp_dir, self._TMP_SUBDIR_NAME,
+                                         env._COMPILER_PROXY))
+
   def tearDown(self):
-    if self._driver:
+    # Tests that already stopped compiler_proxy in a finally block should
+    # not pay for another shutdown sequence here.
+    if self._driver and self._driver._env.CompilerProxyRunning():
       self._driver._EnsureStopCompilerProxy()
     super(GomaCtlLargeTestCommon, self).tearDown()
 
@@ -2916,10 +2944,10 @@ class GomaCtlLargeTestCommon(GomaCtlTestCommon):
     driver._Pull()
     manifest = driver._env.ReadManifest(driver._latest_package_dir)
     self.assertTrue(manifest)
-    self.assertTrue('PLATFORM' in manifest)
+    self.assertIn('PLATFORM', manifest)
     self.assertEqual(manifest['PLATFORM'],
                      self._platform_specific.GetPlatform())
-    self.assertTrue('VERSION' in manifest)
+    self.assertIn('VERSION', manifest)
 
   def testUpdateShouldUpdateManifestAndCompilerProxyButNotAutoRunIt(self):
     """We expect 'update' command updates compiler proxy and manifest.
@@ -2928,20 +2956,16 @@ class GomaCtlLargeTestCommon(GomaCtlTestCommon):
     run before.
     """
     driver = self._module.GetGomaDriver()
-    old_timestamp = os.stat(os.path.join(
-        self._tmp_dir, self._TMP_SUBDIR_NAME,
-        driver._env._COMPILER_PROXY)).st_mtime
+    old_timestamp = self._CompilerProxyMtime(driver._env)
     driver._env._platform = self._platform_specific.GetPlatform()
     self.assertFalse(driver._env.ReadManifest())
     self.assertFalse(driver._env.CompilerProxyRunning())
     driver._Update()
     manifest = driver._env.ReadManifest()
     self.assertTrue(manifest)
-    self.assertTrue('PLATFORM' in manifest)
-    self.assertTrue('VERSION' in manifest)
-    new_timestamp = os.stat(os.path.join(
-        self._tmp_dir, self._TMP_SUBDIR_NAME,
-        driver._env._COMPILER_PROXY)).st_mtime
+    self.assertIn('PLATFORM', manifest)
+    self.assertIn('VERSION', manifest)
+    new_timestamp = self._CompilerProxyMtime(driver._env)
     self.assertNotEqual(old_timestamp, new_timestamp,
                         msg=('Update should update the compiler proxy.'
                              'old: %d, new: %d' % (old_timestamp,
@@ -2950,9 +2974,7 @@ class GomaCtlLargeTestCommon(GomaCtlTestCommon):
 
   def testUpdateShouldUpdateCompilerProxyAndRestartIfItIsRunning(self):
     self._driver = self._module.GetGomaDriver()
-    old_timestamp = os.stat(os.path.join(
-        self._tmp_dir, self._TMP_SUBDIR_NAME,
-        self._driver._env._COMPILER_PROXY)).st_mtime
+    old_timestamp = self._CompilerProxyMtime(self._driver._env)
     self._driver._env._platform = self._platform_specific.GetPlatform()
     try:
       self._driver._StartCompilerProxy()
@@ -2961,9 +2983,7 @@ class GomaCtlLargeTestCommon(GomaCtlTestCommon):
       self.assertTrue(self._driver._env.CompilerProxyRunning())
     finally:
       self._driver._EnsureStopCompilerProxy()
-    new_timestamp = os.stat(os.path.join(
-        self._tmp_dir, self._TMP_SUBDIR_NAME,
-        self._driver._env._COMPILER_PROXY)).st_mtime
+    new_timestamp = self._CompilerProxyMtime(self._driver._env)
     self.assertNotEqual(old_timestamp, new_timestamp,
                         msg=('Update should update the compiler proxy.'
                              'old: %d, new: %d' % (old_timestamp,
@@ -2974,8 +2994,8 @@ class GomaCtlLargeTestCommon(GomaCtlTestCommon):
     driver = self._module.GetGomaDriver()
     manifest = driver._env.ReadManifest()
     self.assertTrue(manifest)
-    self.assertTrue('PLATFORM' in manifest)
-    self.assertTrue('VERSION' in manifest)
+    self.assertIn('PLATFORM', manifest)
+    self.assertIn('VERSION', manifest)
     self.assertNotEqual(manifest['VERSION'], '1')
 
   def testShouldNotAutoUpdateNoAutoUpdate(self):
@@ -2989,8 +3009,8 @@ class GomaCtlLargeTestCommon(GomaCtlTestCommon):
     driver = self._module.GetGomaDriver()
     manifest = driver._env.ReadManifest()
     self.assertTrue(manifest)
-    self.assertTrue('PLATFORM' in manifest)
-    self.assertTrue('VERSION' in manifest)
+    self.assertIn('PLATFORM', manifest)
+    self.assertIn('VERSION', manifest)
     self.assertEqual(manifest['VERSION'], '1')
 
   def testShouldNotAutoUpdateNoVersionInManifest(self):
@@ -3014,9 +3034,7 @@ class GomaCtlLargeTestCommon(GomaCtlTestCommon):
     driver0._env.WriteManifest(manifest)
 
     # Save the current compiler_proxy timestamp.
-    old_timestamp = os.stat(os.path.join(
-        self._tmp_dir, self._TMP_SUBDIR_NAME,
-        driver0._env._COMPILER_PROXY)).st_mtime
+    old_timestamp = self._CompilerProxyMtime(driver0._env)
     self._driver = self._module.GetGomaDriver()
     self._driver._env._platform = self._platform_specific.GetPlatform()
     try:
@@ -3026,19 +3044,21 @@ class GomaCtlLargeTestCommon(GomaCtlTestCommon):
       driver0._EnsureStopCompilerProxy()
 
     # Time stamp should be changed.
-    new_timestamp = os.stat(os.path.join(
-        self._tmp_dir, self._TMP_SUBDIR_NAME,
-        self._driver._env._COMPILER_PROXY)).st_mtime
+    new_timestamp = self._CompilerProxyMtime(self._driver._env)
     self.assertNotEqual(old_timestamp, new_timestamp,
                         msg=('Update should update the compiler proxy.'
                              'old: %d, new: %d' % (old_timestamp,
                                                    new_timestamp)))
 
   def testFetchShouldDownloadPackage(self):
-    # Get list of supported platforms.
-    platforms = []
-    for goma_env in self._module._GOMA_ENVS.values():
-      platforms.extend([x[1] for x in goma_env.PLATFORM_CANDIDATES])
+    # Get list of supported platforms, deduplicated so overlapping
+    # PLATFORM_CANDIDATES entries are downloaded only once.
+    if GomaCtlLargeTestCommon._ALL_PLATFORMS is None:
+      GomaCtlLargeTestCommon._ALL_PLATFORMS = sorted(
+          set(platform
+              for goma_env in self._module._GOMA_ENVS.values()
+              for _, platform in goma_env.PLATFORM_CANDIDATES))
+    platforms = self._ALL_PLATFORMS
 
     # Check packages for them can be downloaded.
     driver = self._module.GetGomaDriver()
@@ -3139,22 +3159,23 @@ class GomaCtlLargeTestCommon(GomaCtlTestCommon):
 
     mtime = time.time() - 5
     stat_dict = {}
-    for f in os.listdir(latest_dir):
-      # change modification time of files in |latest_dir| to check update
-      f_path = os.path.join(latest_dir, f)
-      os.utime(f_path, (mtime, mtime))
-      stat_dict[f] = os.stat(f_path)
+    with os.scandir(latest_dir) as it:
+      for entry in it:
+        # change modification time of files in |latest_dir| to check update
+        os.utime(entry.path, (mtime, mtime))
+        stat_dict[entry.name] = entry.stat()
 
     driver._Pull()
-    for f in os.listdir(latest_dir):
-      if f == 'MANIFEST':
-        # In goma_ctl.py pull, we update timestamp of MANIFEST in latest_dir
-        # to skip frequent update check in goma_ctl.py ensure_start.
-        self.assertNotEqual(stat_dict[f].st_mtime,
-                            os.stat(os.path.join(latest_dir, f)).st_mtime)
-      else:
-        self.assertEqual(stat_dict[f].st_mtime,
-                         os.stat(os.path.join(latest_dir, f)).st_mtime)
+    with os.scandir(latest_dir) as it:
+      for entry in it:
+        if entry.name == 'MANIFEST':
+          # In goma_ctl.py pull, we update timestamp of MANIFEST in latest_dir
+          # to skip frequent update check in goma_ctl.py ensure_start.
+          self.assertNotEqual(stat_dict[entry.name].st_mtime,
+                              entry.stat().st_mtime)
+        else:
+          self.assertEqual(stat_dict[entry.name].st_mtime,
+                           entry.stat().st_mtime)
 
   def testPullShouldUpdateIfFilesAreNotExist(self):
     driver = self._module.GetGomaDriver()
@@ -3243,10 +3264,15 @@ def main():
                            help='goma service account JSON file')
   option_parser.add_option('--small', action='store_true',
                            help='Check small tests only.')
-  option_parser.add_option('--verbosity', default=1,
+  option_parser.add_option('--verbosity', default=1, type='int',
                            help='Verbosity of tests.')
   option_parser.add_option('--port', default='8200',
                            help='compiler_proxy port for large test')
+  option_parser.add_option('--jobs', default='1',
+                           help='number of processes to run large tests.'
+                           '  Each process uses its own compiler_proxy port.')
+  option_parser.add_option('--large-test-filter', default=None,
+                           help=optparse.SUPPRESS_HELP)
   options, _ = option_parser.parse_args()
 
   platform_specific = GetPlatformSpecific(options.platform)
@@ -3259,12 +3285,38 @@ def main():
         platform_specific.GetDefaultGomaCtlPath(test_dir))
   del sys.argv[1:]
 
+  if options.large_test_filter is not None:
+    # Shard worker spawned by the parent run below: run only the named
+    # large tests serially on the given port and report through the exit
+    # status.
+    clients5_key = options.goma_service_account_json_file
+    if not clients5_key and platform_specific.GetCred():
+      clients5_key = platform_specific.GetCred()
+    assert clients5_key
+    suite = unittest.TestSuite()
+    for name in options.large_test_filter.split(','):
+      suite.addTest(
+          GomaCtlLargeClients5Test(name,
+                                   goma_ctl_path=goma_ctl_path,
+                                   platform_specific=platform_specific,
+                                   oauth2_file=clients5_key,
+                                   port=int(options.port)))
+    result = unittest.TextTestRunner(verbosity=options.verbosity).run(suite)
+    exit_code = 0
+    if result.errors:
+      exit_code |= 0x01
+    if result.failures:
+      exit_code |= 0x02
+    sys.exit(exit_code)
+
   # Execute test.
   suite = unittest.TestSuite()
   suite.addTest(
       GetParameterizedTestSuite(GomaCtlSmallTest,
                                 goma_ctl_path=goma_ctl_path,
                                 platform_specific=platform_specific))
+  large_shards = []
+  base_port = int(options.port)
   if not options.small:
     suite.addTest(
         GetParameterizedTestSuite(GomaEnvTest,
@@ -3274,20 +3326,51 @@ def main():
     if not clients5_key and platform_specific.GetCred():
       clients5_key = platform_specific.GetCred()
     assert clients5_key
-    suite.addTest(
-        GetParameterizedTestSuite(GomaCtlLargeClients5Test,
-                                  goma_ctl_path=goma_ctl_path,
-                                  platform_specific=platform_specific,
-                                  oauth2_file=clients5_key,
-                                  port=options.port))
-  result = unittest.TextTestRunner(verbosity=options.verbosity).run(suite)
+    large_test_names = unittest.TestLoader().getTestCaseNames(
+        GomaCtlLargeClients5Test)
+    jobs = max(1, min(int(options.jobs), len(large_test_names)))
+    if jobs == 1:
+      suite.addTest(
+          GetParameterizedTestSuite(GomaCtlLargeClients5Test,
+                                    goma_ctl_path=goma_ctl_path,
+                                    platform_specific=platform_specific,
+                                    oauth2_file=clients5_key,
+                                    port=base_port))
+    else:
+      # setUp/tearDown publish each test's port and tmp dir through
+      # os.environ, swap sys.stdout, and re-execute goma_ctl into the
+      # shared sys.modules entry, so shards must be isolated in their own
+      # processes; threads would overwrite each other's state.  Each shard
+      # re-runs this script with a test-name filter and its own port.
+      for i in range(jobs):
+        names = large_test_names[i::jobs]
+        if names:
+          large_shards.append((base_port + i, names))
 
-  # Return test status as exit status.
+  result = unittest.TextTestRunner(verbosity=options.verbosity).run(suite)
   exit_code = 0
   if result.errors:
     exit_code |= 0x01
   if result.failures:
     exit_code |= 0x02
+
+  if large_shards:
+    script = os.path.abspath(__file__)
+    procs = []
+    for port, names in large_shards:
+      cmd = [sys.executable, script,
+             '--goma-dir', goma_ctl_path,
+             '--verbosity', str(options.verbosity),
+             '--port', str(port),
+             '--large-test-filter', ','.join(names)]
+      if options.platform:
+        cmd.extend(['--platform', options.platform])
+      if clients5_key:
+        cmd.extend(['--goma-service-account-json-file', clients5_key])
+      procs.append(subprocess.Popen(cmd))
+    for proc in procs:
+      exit_code |= proc.wait()
+
   if exit_code:
     sys.exit(exit_code)
 
@@ -13,31 +13,30 @@ This is the regression test for crbug.com/904532.
 
 import os
 import re
-import select
 import shutil
 import socket
 import subprocess
-import sys
 import tempfile
 
-# TODO: remove this when we deprecate python2.
-if sys.version_info >= (3, 0):
-  import io
-  STRINGIO = io.StringIO
-else:
-  import cStringIO
-  STRINGIO = cStringIO.StringIO
-
 
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
-CONTENT_LENGTH_PATTERN = re.compile('\r\nContent-Length:\s*(\d+)\r\n')
+CONTENT_LENGTH_PATTERN = re.compile(br'\r\nContent-Length:\s*(\d+)\r\n')
 READ_TIMEOUT_IN_SEC = 5.0
+# Large enough for a typical gomacc request to arrive in one or two recvs.
+RECV_BUFFER_SIZE = 65536
+
+
+_goma_dir = None
 
 
 def GomaDir():
   """Returns goma's directory."""
-  return os.environ.get('GOMA_DIR',
-                        os.path.join(SCRIPT_DIR, '..', 'out', 'Release'))
+  global _goma_dir
+  if _goma_dir is None:
+    _goma_dir = os.environ.get('GOMA_DIR',
+                               os.path.join(SCRIPT_DIR, '..', 'out',
+                                            'Release'))
+  return _goma_dir
 
 
 def GetGomaccPath():
@@ -52,12 +51,14 @@ def GetGomaCtlPath():
 
 def FindAvailablePort():
   """Returns available port number."""
-  for p in range(9000, 9100):
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    res = s.connect_ex(('localhost', p))
-    if res != 0:
-      return p
-  raise Execption('Cannot find available port')
+  # The kernel atomically allocates a free port on bind to port 0; no need
+  # to probe candidates with connect.
+  s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  try:
+    s.bind(('localhost', 0))
+    return s.getsockname()[1]
+  finally:
+    s.close()
 
 
 class CompilerProxyManager(object):
@@ -76,9 +77,11 @@ class CompilerProxyManager(object):
     self.tmpdir = tempfile.mkdtemp()
     self.port = FindAvailablePort()
     self.ipc_socket = os.path.join(self.tmpdir, 'goma.ipc')
-    os.environ['GOMA_TMP_DIR'] = self.tmpdir
-    os.environ['GOMA_COMPILER_PROXY_PORT'] = str(self.port)
-    os.environ['GOMA_COMPILER_PROXY_SOCKET_NAME'] = self.ipc_socket
+    os.environ.update({
+        'GOMA_TMP_DIR': self.tmpdir,
+        'GOMA_COMPILER_PROXY_PORT': str(self.port),
+        'GOMA_COMPILER_PROXY_SOCKET_NAME': self.ipc_socket,
+    })
     subprocess.check_call([self.goma_ctl, 'ensure_start'])
     return self
 
@@ -101,18 +104,18 @@ def GetContentLength(header):
   """Returns content-length in HTTP header, or None.
 
   Args:
-    header: HTTP header.
+    header: HTTP header bytes.
 
   Returns:
-    long content-length or None.
+    int content-length or None.
 
-  >>> GetContentLength('POST /e HTTP/1.1\\r\\nContent-Length: 140\\r\\n\\r\\n')
-  140L
-  >>> GetContentLength('POST /e HTTP/1.1\\r\\nHost: 0.0.0.0\\r\\n\\r\\n')
+  >>> GetContentLength(b'POST /e HTTP/1.1\\r\\nContent-Length: 140\\r\\n\\r\\n')
+  140
+  >>> GetContentLength(b'POST /e HTTP/1.1\\r\\nHost: 0.0.0.0\\r\\n\\r\\n')
   """
   matched = CONTENT_LENGTH_PATTERN.search(header)
   if matched:
-    return int(matched.group(1))
+    return int(matched.group(1).decode('ascii'))
   return None
 
 
@@ -125,22 +128,33 @@ def ReadAll(conn):
   Returns:
     data read from conn.
   """
-  data = STRINGIO()
+  CRLFCRLF = b'\r\n\r\n'
+  buf = bytearray()
+  scan_start = 0
+  header_end = -1
+  content_length = None
   while True:
-    ready, _, _ = select.select([conn], [], [], READ_TIMEOUT_IN_SEC)
-    if not ready:
+    # The socket has a read timeout instead of being nonblocking, so each
+    # chunk costs one recv syscall with no select round-trip.
+    try:
+      snippet = conn.recv(RECV_BUFFER_SIZE)
+    except socket.timeout:
       raise Exception('read time out')
-    snippet = conn.recv(16)
     if not snippet:
       return
-    data.write(snippet)
-    CRLFCRLF = '\r\n\r\n'
-    pos = data.getvalue().find(CRLFCRLF)
-    if pos != -1:
-      pos += len(CRLFCRLF)
-      content_length = GetContentLength(data.getvalue()[:pos])
-      if content_length and (len(data.getvalue()) - pos) == content_length:
-        return data.getvalue()
+    buf += snippet
+    if header_end < 0:
+      # Only scan the newly received region (with overlap in case the marker
+      # is split across reads); rescanning the whole buffer per recv would be
+      # quadratic in message size.
+      pos = buf.find(CRLFCRLF, max(0, scan_start - (len(CRLFCRLF) - 1)))
+      scan_start = len(buf)
+      if pos != -1:
+        header_end = pos + len(CRLFCRLF)
+        content_length = GetContentLength(bytes(buf[:header_end]))
+    if header_end >= 0:
+      if content_length and (len(buf) - header_end) == content_length:
+        return bytes(buf)
 
 
 def GetGomaccData():
@@ -159,7 +173,7 @@ def GetGomaccData():
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE)
     conn, _ = sock.accept()
-    conn.setblocking(0)
+    conn.settimeout(READ_TIMEOUT_IN_SEC)
     data = ReadAll(conn)
     proc.kill()
   finally:
@@ -174,7 +188,9 @@ def main():
   with CompilerProxyManager() as cpm:
     before = cpm.Stat()
     s.connect((cpm.ipc_socket))
-    s.send(data)
+    # sendall retries partial writes; memoryview avoids copying the buffer
+    # on each retry.
+    s.sendall(memoryview(data))
     s.close()
     if not cpm.IsRunning():
       raise Exception('compiler_proxy is not running')
@@ -10,38 +10,96 @@ The script uses the production servers.
 
 from __future__ import print_function
 
-import glob
 import imp
+import json
+import mmap
 import optparse
 import os
 import re
 import shutil
+import socket
 import string
 import subprocess
 import sys
 import tempfile
 import unittest
 try:
-  import urllib.request, urllib.error
-  URLOPEN = urllib.request.urlopen
-  URLREQUEST = urllib.request.Request
-  HTTPERROR = urllib.error.HTTPError
+  import http.client
+  HTTPCONNECTION = http.client.HTTPConnection
+  HTTPEXCEPTION = http.client.HTTPException
 except ImportError:
-  import urllib2
-  URLOPEN = urllib2.urlopen
-  URLREQUEST = urllib2.Request
-  HTTPERROR = urllib2.HTTPError
+  import httplib
+  HTTPCONNECTION = httplib.HTTPConnection
+  HTTPEXCEPTION = httplib.HTTPException
 
 
 _GOMA_CTL = 'goma_ctl.py'
 _SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 _CRED = 'c:\\creds\\service_accounts\\service-account-goma-client.json'
+# Test inputs, relative to the goma client checkout the tests chdir into.
+_HELLO_C = os.path.join('test', 'hello.c')
+_BADREQ_BIN = os.path.join('test', 'badreq.bin')
+_VS_PATH_PATTERN = re.compile(r'^vs_path\s+=\s+"([^"]+)"')
+_SDK_PATH_PATTERN = re.compile(r'^sdk_path\s+=\s+"([^"]+)"')
+
+# Translation table lowercasing printable bytes, used to normalize obj files
+# before comparison.
+_NORMALIZE_TABLE = bytearray(range(256))
+for _c in bytearray(string.printable.encode('latin-1')):
+  _NORMALIZE_TABLE[_c] = ord(chr(_c).lower())
+_NORMALIZE_TABLE = bytes(_NORMALIZE_TABLE)
+
+# Number of bytes compared at a time when diffing mmapped obj files, so the
+# maps are never fully materialized into the python heap.
+_COMPARE_CHUNK_SIZE = 1 << 20
+
+
+def _MappedSuffixesEqual(m0, m1, start):
+  """Compares two equal-length mmaps from the given offset.
+
+  Args:
+    m0: a read-only mmap.
+    m1: a read-only mmap of the same length as m0.
+    start: byte offset to start the comparison at.
+
+  Returns:
+    True if both maps have the same content from start to the end.
+  """
+  for off in range(start, len(m0), _COMPARE_CHUNK_SIZE):
+    if m0[off:off + _COMPARE_CHUNK_SIZE] != m1[off:off + _COMPARE_CHUNK_SIZE]:
+      return False
+  return True
 
 
 class Error(Exception):
   """Raised on error."""
 
 
+_goma_ctl_module_cache = {}
+
+
+def _LoadGomaCtl(goma_dir):
+  """Loads goma_ctl.py from goma_dir, reusing an already loaded module.
+
+  imp.load_source parses, compiles, and executes the script; doing that
+  once per parameterized test method adds up, so the loaded module is
+  cached per path.
+
+  Args:
+    goma_dir: a string of directory goma_ctl.py is located in.
+
+  Returns:
+    a goma_ctl module.
+  """
+  path = os.path.abspath(os.path.join(goma_dir, _GOMA_CTL))
+  module = _goma_ctl_module_cache.get(path)
+  if module is None:
+    mod_name, _ = os.path.splitext(_GOMA_CTL)
+    module = imp.load_source(mod_name, path)
+    _goma_ctl_module_cache[path] = module
+  return module
+
+
 class SimpleTryTest(unittest.TestCase):
   """Goma Simple Try Test."""
 
@@ -58,57 +116,109 @@ class SimpleTryTest(unittest.TestCase):
     self._dir = os.path.abspath(goma_dir)
     self.local_cl = local_cl
     self.gomacc = gomacc
-    mod_name, _ = os.path.splitext(_GOMA_CTL)
-    self._module = imp.load_source(mod_name, os.path.join(goma_dir, _GOMA_CTL))
+    self._module = _LoadGomaCtl(goma_dir)
 
   @staticmethod
   def RemoveFile(fname):
     """Removes the file and ignores error."""
     try:
       os.remove(fname)
-    except Exception:
+    except OSError:
+      # The file usually just does not exist; anything else (e.g. a held
+      # lock on Windows) is also best-effort here.
       pass
 
   def setUp(self):
-    # Sets environmental variables.
-    os.environ['GOMA_STORE_ONLY'] = 'true'
-    os.environ['GOMA_DUMP'] = 'true'
-    os.environ['GOMA_RETRY'] = 'false'
-    os.environ['GOMA_FALLBACK'] = 'false'
-    os.environ['GOMA_USE_LOCAL'] = 'false'
-    os.environ['GOMA_START_COMPILER_PROXY'] = 'false'
-    # remote link not implemented on windows yet.
-    os.environ['GOMA_STORE_LOCAL_RUN_OUTPUT'] = 'false'
-    os.environ['GOMA_ENABLE_REMOTE_LINK'] = 'false'
-    os.environ['GOMA_GOMACC_WRITE_LOG_FOR_TESTING'] = 'false'
+    # Sets environmental variables in one batch.
+    os.environ.update({
+        'GOMA_STORE_ONLY': 'true',
+        'GOMA_DUMP': 'true',
+        'GOMA_RETRY': 'false',
+        'GOMA_FALLBACK': 'false',
+        'GOMA_USE_LOCAL': 'false',
+        'GOMA_START_COMPILER_PROXY': 'false',
+        # remote link not implemented on windows yet.
+        'GOMA_STORE_LOCAL_RUN_OUTPUT': 'false',
+        'GOMA_ENABLE_REMOTE_LINK': 'false',
+        'GOMA_GOMACC_WRITE_LOG_FOR_TESTING': 'false',
+    })
     self._cwd = os.getcwd()
 
   def tearDown(self):
-    self.RemoveFile('local.obj')
-    self.RemoveFile('remote.obj')
-    self.RemoveFile('hello.exe')
-    self.RemoveFile('create_pch.obj')
-    self.RemoveFile('use_pch.obj')
+    for fname in ('local.obj', 'remote.obj', 'hello.exe', 'create_pch.obj',
+                  'use_pch.obj'):
+      self.RemoveFile(fname)
     for log in self.GetGomaccLogs():
       self.RemoveFile(log)
     os.chdir(self._cwd)
 
+  # HTTP connection to compiler_proxy, kept alive across requests.
+  _proxy_conn = None
+
+  # Resolved log directory, cached per test by GetGomaccLogs.
+  _log_dir = None
+
+  def _ProxyRequest(self, method, path, body=None, headers=None):
+    """Sends an HTTP request to compiler_proxy.
+
+    The connection is kept alive on the class, so all fetches in the suite
+    reuse one TCP connection instead of paying a handshake per URL.
+
+    Args:
+      method: an HTTP method, e.g. 'GET'.
+      path: a path on compiler_proxy, e.g. '/statz'.
+      body: an optional request body.
+      headers: an optional dictionary of request headers.
+
+    Returns:
+      a tuple of (status code, response body).
+    """
+    if SimpleTryTest._proxy_conn is None:
+      SimpleTryTest._proxy_conn = HTTPCONNECTION(
+          'localhost', int(os.environ['GOMA_COMPILER_PROXY_PORT']))
+    conn = SimpleTryTest._proxy_conn
+    try:
+      conn.request(method, path, body, headers or {})
+      resp = conn.getresponse()
+    except (socket.error, HTTPEXCEPTION):
+      # compiler_proxy dropped the kept-alive connection; reconnect once.
+      conn.close()
+      conn.request(method, path, body, headers or {})
+      resp = conn.getresponse()
+    # Drain the body so the connection can be reused.
+    return resp.status, resp.read()
+
+  def _GetStatz(self):
+    """Returns compiler_proxy /statz contents."""
+    return self._ProxyRequest('GET', '/statz')[1]
+
   @staticmethod
   def ExecCommand(cmd):
     """Execute given list of command.
 
+    stdout and stderr are spooled to temporary files so successful commands
+    do not materialize their output in memory; read them back only when a
+    failure needs to be reported.
+
     Args:
       cmd: a list of command line args.
 
     Returns:
-      a tuple of proc instance, stdout string and stderr string.
+      a tuple of proc instance and two file objects spooling stdout and
+      stderr.
     """
-    proc = subprocess.Popen(cmd,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE)
-    (out, err) = proc.communicate()
+    out = tempfile.SpooledTemporaryFile(max_size=64 * 1024)
+    err = tempfile.SpooledTemporaryFile(max_size=64 * 1024)
+    proc = subprocess.Popen(cmd, stdout=out, stderr=err)
+    proc.wait()
     return (proc, out, err)
 
+  @staticmethod
+  def _ReadSpooled(f):
+    """Returns contents of an ExecCommand output file."""
+    f.seek(0)
+    return f.read()
+
   def AssertSuccess(self, cmd, msg=''):
     """Asserts given command succeeds.
 
@@ -119,7 +229,9 @@ class SimpleTryTest(unittest.TestCase):
     if msg:
       msg += '\n'
     (proc, out, err) = self.ExecCommand(cmd)
-    self.assertEqual(proc.returncode, 0, msg=('%s%s\n%s\n' % (msg, out, err)))
+    if proc.returncode != 0:
+      self.fail('%s%s\n%s\n' % (msg, self._ReadSpooled(out),
+                                self._ReadSpooled(err)))
 
   def AssertFailure(self, cmd, msg=''):
     """Asserts given command fails.
@@ -131,8 +243,9 @@ class SimpleTryTest(unittest.TestCase):
     if msg:
       msg += '\n'
     (proc, out, err) = self.ExecCommand(cmd)
-    self.assertNotEqual(proc.returncode, 0,
-                        msg=('%s%s\n%s\n' % (msg, out, err)))
+    if proc.returncode == 0:
+      self.fail('%s%s\n%s\n' % (msg, self._ReadSpooled(out),
+                                self._ReadSpooled(err)))
 
   def AssertSameFile(self, files, msg=''):
     """Asserts given two files are the same.
@@ -141,50 +254,47 @@ class SimpleTryTest(unittest.TestCase):
       files: a list of two files to check.
       msg: additional message to be shown.
     """
-    a = open(files[0], 'rb').read()
-    b = open(files[1], 'rb').read()
-    a_size = os.stat(files[0]).st_size
-    b_size = os.stat(files[1]).st_size
+    # mmap lets the OS page the files in on demand instead of copying both
+    # into the python heap; the full contents are only materialized when
+    # there is a real mismatch and diagnostics have to be built.
+    with open(files[0], 'rb') as fa, open(files[1], 'rb') as fb:
+      m0 = mmap.mmap(fa.fileno(), 0, access=mmap.ACCESS_READ)
+      m1 = mmap.mmap(fb.fileno(), 0, access=mmap.ACCESS_READ)
+      try:
+        if (len(m0) == len(m1) and m0[:4] == m1[:4] and
+            _MappedSuffixesEqual(m0, m1, 8)):
+          return  # Same except possibly the Time/Date Stamp; expected case.
+        a = m0[:]
+        b = m1[:]
+      finally:
+        m0.close()
+        m1.close()
 
     if msg:
       msg += '\n'
-    self.assertEqual(a_size, len(a),
-                     msg=('%sparsial read?: %s %d!=%d' % (msg, files[0],
-                                                          a_size, len(a))))
-    self.assertEqual(b_size, len(b),
-                     msg=('%sparsial read?: %s %d!=%d' % (msg, files[1],
-                                                          b_size, len(b))))
-    if a == b:
-      return  # Success.
-
     self.assertEqual(len(a), len(b),
                      msg=('%ssize mismatch: %s=%d %s=%d' % (msg,
                                                             files[0], len(a),
                                                             files[1], len(b))))
-    idx = -1
-    ndiff = 0
-    for ach, bch in zip(a, b):
-      idx += 1
-      # http://support.microsoft.com/kb/121460/en
-      # Header structure (0 - 20 bytes):
-      #  0 -  2: Machine
-      #  2 -  4: Number of sections.
-      #  4 -  8: Time/Date Stamp.
-      #  8 - 12: Pointer to Symbol Table.
-      # 12 - 16: Number of Symbols.
-      # 16 - 18: Optional Header Size.
-      # 18 - 20: Characteristics.
-      if idx in range(4, 8):  # Time/Date Stamp can be different.
-        continue
-      # Since compiler_proxy normalize path names to lower case, we should
-      # normalize printable charactors before comparison.
-      if ach in string.printable:
-        ach = ach.lower()
-      if bch in string.printable:
-        bch = bch.lower()
-
-      if ach != bch:
-        ndiff += 1
+    # http://support.microsoft.com/kb/121460/en
+    # Header structure (0 - 20 bytes):
+    #  0 -  2: Machine
+    #  2 -  4: Number of sections.
+    #  4 -  8: Time/Date Stamp.
+    #  8 - 12: Pointer to Symbol Table.
+    # 12 - 16: Number of Symbols.
+    # 16 - 18: Optional Header Size.
+    # 18 - 20: Characteristics.
+    # Time/Date Stamp (bytes 4 - 8) can be different, so zero it out.
+    # Since compiler_proxy normalize path names to lower case, we should
+    # normalize printable charactors before comparison.  translate() does
+    # this in one pass in C instead of a per-byte python loop.
+    norm_a = (a[:4] + b'\x00\x00\x00\x00' + a[8:]).translate(_NORMALIZE_TABLE)
+    norm_b = (b[:4] + b'\x00\x00\x00\x00' + b[8:]).translate(_NORMALIZE_TABLE)
+    if norm_a == norm_b:
+      ndiff = 0
+    else:
+      ndiff = sum(1 for ach, bch in zip(norm_a, norm_b) if ach != bch)
     print('%d bytes differ' % ndiff)
     self.assertEqual(ndiff, 0,
                      msg=('%sobj file should be the same after normalize.'
@@ -203,9 +313,17 @@ class SimpleTryTest(unittest.TestCase):
                         msg=('%s%s is empty' % (msg, filename)))
 
   def GetGomaccLogs(self):
-    logdir = self._module._GetLogDirectory()
-    assert logdir
-    return glob.glob(os.path.join(logdir, "gomacc.*"))
+    # The log directory cannot change while a test runs, so resolve it once
+    # per test instead of re-reading the environment on every call.
+    logdir = self._log_dir
+    if logdir is None:
+      logdir = self._module._GetLogDirectory()
+      assert logdir
+      self._log_dir = logdir
+    # A prefix check on listdir is enough here; glob would compile and run
+    # an fnmatch pattern per entry.
+    return [os.path.join(logdir, name)
+            for name in os.listdir(logdir) if name.startswith('gomacc.')]
 
   def AssertNoGomaccInfo(self):
     """Asserts if gomacc.INFO does not exist."""
@@ -226,11 +344,11 @@ class SimpleTryTest(unittest.TestCase):
     # Since object file contains a file name, an output file name should be
     # the same.
     self.AssertSuccess([self.local_cl, '/c', '/Brepro', '/Fotest.obj',
-                        os.path.join('test', 'hello.c')],
+                        _HELLO_C],
                        msg='local compile')
     shutil.move('test.obj', 'local.obj')
     self.AssertSuccess([self.gomacc, self.local_cl, '/c', '/Brepro',
-                        '/Fotest.obj', os.path.join('test', 'hello.c')],
+                        '/Fotest.obj', _HELLO_C],
                        msg='remote compile')
     shutil.move('test.obj', 'remote.obj')
 
@@ -242,7 +360,7 @@ class SimpleTryTest(unittest.TestCase):
 
   def testDashFlag(self):
     self.AssertSuccess([self.gomacc, self.local_cl, '-c', '-Fotest.obj',
-                        os.path.join('test', 'hello.c')],
+                        _HELLO_C],
                        msg='remote compile')
     shutil.move('test.obj', 'remote.obj')
     self.AssertSuccess([self.local_cl, '/Fehello.exe', 'remote.obj'],
@@ -255,13 +373,13 @@ class SimpleTryTest(unittest.TestCase):
     # the same.
     self.AssertSuccess([self.gomacc, self.local_cl,
                         '/c', '/Fotest.obj', '/FIstdio.h', '/Ycstdio.h',
-                        '/Brepro', os.path.join('test', 'hello.c')],
+                        '/Brepro', _HELLO_C],
                        msg='cl_create_pch')
     shutil.move('test.obj', 'create_pch.obj')
     self.AssertNotEmptyFile('stdio.pch', msg='cl_create_pch_exist')
     self.AssertSuccess([self.gomacc, self.local_cl,
                         '/c', '/Fotest.obj', '/FIstdio.h', '/Yustdio.h',
-                        '/Brepro', os.path.join('test', 'hello.c')],
+                        '/Brepro', _HELLO_C],
                        msg='cl_use_pch')
     shutil.move('test.obj', 'use_pch.obj')
     # TODO: investigate pch mismatch.
@@ -275,61 +393,54 @@ class SimpleTryTest(unittest.TestCase):
     self.AssertNoGomaccInfo()
 
   def testDisabledShouldWork(self):
-    stat_url = 'http://localhost:%s/statz' % (
-        os.environ['GOMA_COMPILER_PROXY_PORT'])
-    stat_before = URLOPEN(stat_url).read()
+    stat_before = self._GetStatz()
     os.environ['GOMA_DISABLED'] = 'true'
     self.AssertSuccess([self.gomacc, self.local_cl, '/c', '/Fotest.obj',
-                        os.path.join('test', 'hello.c')],
+                        _HELLO_C],
                        msg='remote compile')
     del os.environ['GOMA_DISABLED']
-    stat_after = URLOPEN(stat_url).read()
-    request_line_before = '\n'.join(
-        [line for line in stat_before.split('\n') if 'request' in line])
-    request_line_after = '\n'.join(
-        [line for line in stat_after.split('\n') if 'request' in line])
-    self.assertNotEqual(request_line_before, '')
-    self.assertNotEqual(request_line_after, '')
-    self.assertEqual(request_line_before, request_line_after)
+    stat_after = self._GetStatz()
+    # Only equality of the filtered lines matters; no need to rejoin them.
+    request_lines_before = tuple(
+        line for line in stat_before.splitlines() if b'request' in line)
+    request_lines_after = tuple(
+        line for line in stat_after.splitlines() if b'request' in line)
+    self.assertNotEqual(request_lines_before, ())
+    self.assertNotEqual(request_lines_after, ())
+    self.assertEqual(request_lines_before, request_lines_after)
     self.AssertNoGomaccInfo()
 
   def testLocalFallbackShouldWork(self):
-    stat_url = 'http://localhost:%s/statz' % (
-        os.environ['GOMA_COMPILER_PROXY_PORT'])
-    stat_before = URLOPEN(stat_url).read()
-    os.environ['GOMA_FALLBACK_INPUT_FILES'] = os.path.join('test', 'hello.c')
+    stat_before = self._GetStatz()
+    os.environ['GOMA_FALLBACK_INPUT_FILES'] = _HELLO_C
     self.AssertSuccess([self.gomacc, self.local_cl, '/c', '/Fotest.obj',
-                        os.path.join('test', 'hello.c')],
+                        _HELLO_C],
                        msg='local fallback')
     del os.environ['GOMA_FALLBACK_INPUT_FILES']
-    stat_after = URLOPEN(stat_url).read()
-    request_line_before = '\n'.join(
-        [line for line in stat_before.split('\n') if 'fallback' in line])
-    request_line_after = '\n'.join(
-        [line for line in stat_after.split('\n') if 'fallback' in line])
-    self.assertNotEqual(request_line_before, '')
-    self.assertNotEqual(request_line_after, '')
-    self.assertNotEqual(request_line_before, request_line_after)
+    stat_after = self._GetStatz()
+    fallback_lines_before = tuple(
+        line for line in stat_before.splitlines() if b'fallback' in line)
+    fallback_lines_after = tuple(
+        line for line in stat_after.splitlines() if b'fallback' in line)
+    self.assertNotEqual(fallback_lines_before, ())
+    self.assertNotEqual(fallback_lines_after, ())
+    self.assertNotEqual(fallback_lines_before, fallback_lines_after)
     self.AssertNoGomaccInfo()
 
   def testClInPathShouldCompile(self):
     self.AssertSuccess([self.gomacc, 'clang-cl', '/c', '/Fotest.obj',
-                        os.path.join('test', 'hello.c')],
+                        _HELLO_C],
                        msg='clang-cl.exe in path env. compile')
     self.AssertNotEmptyFile('test.obj', msg='cl_test_obj')
     self.AssertNoGomaccInfo()
 
   def testAccessCheck(self):
-    url = 'http://localhost:%s/e' % (
-        os.environ['GOMA_COMPILER_PROXY_PORT'])
-    with open(os.path.join('test', 'badreq.bin'), 'rb') as f:
+    with open(_BADREQ_BIN, 'rb') as f:
       req_data = f.read()
-    req = URLREQUEST(url, req_data)
-    req.add_header('Content-Type', 'binary/x-protocol-buffer')
-    with self.assertRaises(HTTPERROR) as cm:
-      URLOPEN(req)
-    ec = cm.exception.getcode()
-    self.assertEqual(ec, 401, msg=('response code=%d; want=401' % ec))
+    status, _ = self._ProxyRequest(
+        'POST', '/e', body=req_data,
+        headers={'Content-Type': 'binary/x-protocol-buffer'})
+    self.assertEqual(status, 401, msg=('response code=%d; want=401' % status))
     self.AssertNoGomaccInfo()
 
   def testGomaccShouldLog(self):
@@ -381,9 +492,7 @@ class CompilerProxyManager(object):
       service_account_file: a string of service account filename.
     """
     # create goma_ctl.
-    mod_name, _ = os.path.splitext(_GOMA_CTL)
-    self._module = imp.load_source(mod_name,
-                                   os.path.join(goma_ctl_path, _GOMA_CTL))
+    self._module = _LoadGomaCtl(goma_ctl_path)
     self._kill = kill
     self._tmpdir = None
     self._port = int(port)
@@ -402,11 +511,13 @@ class CompilerProxyManager(object):
   def __enter__(self):
     self._tmpdir = tempfile.mkdtemp()
     print('GOMA_TMP_DIR: %s' % self._tmpdir)
-    os.environ['GOMA_TMP_DIR'] = self._tmpdir
-    os.environ['TEST_TMPDIR'] = self._tmpdir
-    os.environ['TMPDIR'] = self._tmpdir
-    os.environ['TMP'] = self._tmpdir
-    os.environ['GOMA_DEPS_CACHE_FILE'] = 'deps_cache'
+    os.environ.update({
+        'GOMA_TMP_DIR': self._tmpdir,
+        'TEST_TMPDIR': self._tmpdir,
+        'TMPDIR': self._tmpdir,
+        'TMP': self._tmpdir,
+        'GOMA_DEPS_CACHE_FILE': 'deps_cache',
+    })
     assert self._module._GetLogDirectory() == self._tmpdir
 
     os.environ['GOMA_COMPILER_PROXY_PORT'] = str(self._port)
@@ -450,6 +561,36 @@ class CompilerProxyManager(object):
       shutil.rmtree(self._tmpdir)
 
 
+# Environment variables captured from the depot_tools toolchain setup and
+# cached between runs by _SetupVSEnv.
+_VSENV_KEYS = ('INCLUDE', 'LIB', 'PATH')
+_VSENV_CACHE_NAME = 'goma_vsenv.json'
+
+
+def _LoadCachedVSEnv(cache_path):
+  """Returns cached toolchain environment variables, or None.
+
+  Args:
+    cache_path: a path of the json file written by _SetupVSEnv.
+
+  Returns:
+    a dictionary of environment variables, or None if the cache is missing,
+    malformed, or refers to directories that no longer exist.
+  """
+  try:
+    with open(cache_path) as f:
+      env = json.load(f)
+  except (IOError, OSError, ValueError):
+    return None
+  for key in _VSENV_KEYS:
+    if key not in env:
+      return None
+    for path in env[key].split(os.pathsep):
+      if path and not os.path.exists(path):
+        return None
+  return env
+
+
 def _SetupVSEnv():
   """Setup Environment for Visual Studio SDK.
 
@@ -472,35 +613,56 @@ def _SetupVSEnv():
 
   # Cannot find cl.exe in PATH.  Let me set it in depot_tools.
   # The script also set INCLUDE, LIB, PATH at the same time.
+  # The toolchain environment is deterministic per machine and capturing it
+  # spawns vs_toolchain.py and setenv.cmd, which take seconds on Windows,
+  # so it is cached and reused while the recorded directories stay valid.
+  cache_path = os.path.join(tempfile.gettempdir(), _VSENV_CACHE_NAME)
+  cached = _LoadCachedVSEnv(cache_path)
+  if cached:
+    print('Going to use cl.exe in depot_tools (cached env).')
+    for key in _VSENV_KEYS:
+      os.environ[key] = cached[key]
+      print('os.environ[%s] = "%s"' % (key, cached[key]))
+    return
   print('Going to use cl.exe in depot_tools.')
   out = subprocess.check_output(['python',
                                  os.path.join(_SCRIPT_DIR, '..', 'build',
                                               'vs_toolchain.py'),
                                  'get_toolchain_dir'])
-  vs_path_pattern = re.compile('^vs_path\s+=\s+"([^"]+)"')
-  sdk_path_pattern = re.compile('^sdk_path\s+=\s+"([^"]+)"')
   vs_path = None
   sdk_path = None
+  # Both patterns are anchored at the line head, so match suffices and the
+  # scan can stop once both values are known.
   for line in out.splitlines():
-    matched = vs_path_pattern.search(line)
+    matched = _VS_PATH_PATTERN.match(line)
     if matched:
       vs_path = matched.group(1)
       print('vs_path=%s' % vs_path)
-    matched = sdk_path_pattern.search(line)
+    matched = _SDK_PATH_PATTERN.match(line)
     if matched:
       sdk_path = matched.group(1)
       print('sdk_path=%s' % sdk_path)
+    if vs_path and sdk_path:
+      break
   if not vs_path or not sdk_path:
     raise Error('Do not know proper vs_path or sdk_path.')
   # Since clang-cl.exe generates x64 binary by default, we should use
   # x64 configs.
   out = subprocess.check_output([os.path.join(sdk_path, 'bin/setenv.cmd'),
                                  '/x64', '&&', 'set'])
+  captured = {}
   for line in out.splitlines():
-    key, value = line.split('=')
-    if key.upper() in ('INCLUDE', 'LIB', 'PATH'):
+    # Values like PATH contain '=' themselves; only split on the first one.
+    key, value = line.split('=', 1)
+    if key.upper() in _VSENV_KEYS:
       os.environ[key] = value
+      captured[key.upper()] = value
       print('os.environ[%s] = "%s"' % (key, os.environ[key]))
+  try:
+    with open(cache_path, 'w') as f:
+      json.dump(captured, f)
+  except (IOError, OSError):
+    pass  # The cache is best effort.
 
 
 def _FindClangCl():
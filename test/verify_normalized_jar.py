@@ -14,35 +14,46 @@ The program confirms:
   - normalized_jar_file has the same contents with original jar file.
 """
 
-import datetime
 import hashlib
 import os
-import shutil
-import subprocess
 import sys
-import tempfile
-import time
+import zipfile
 
 
-JAR_COMMAND_PATH = '/usr/bin/jar'
+# Timestamp all normalized jar members must carry.
+MSDOS_EPOCH = (1980, 1, 1, 0, 0, 0)
 
 
-def CalcFileSha256(filename):
-  """Returns SHA256 of the file.
+def _CalcStreamSha256(f):
+  """Returns SHA256 of a binary file object.
+
+  The stream is hashed in chunks so large jar members are not held in
+  memory at once.
 
   Args:
-    filename: a string file name to calculate SHA256.
+    f: a binary file object to hash.
 
   Returns:
-    hexdigest string of the file content.
+    hexdigest string of the stream content.
   """
-  with open(filename, 'rb') as f:
-    return hashlib.sha256(f.read()).hexdigest()
+  if hasattr(hashlib, 'file_digest'):
+    # python 3.11+; reads and hashes in chunks in C.
+    return hashlib.file_digest(f, 'sha256').hexdigest()
+  digest = hashlib.sha256()
+  while True:
+    chunk = f.read(1 << 20)
+    if not chunk:
+      break
+    digest.update(chunk)
+  return digest.hexdigest()
 
 
 def GetListOfContents(filename):
   """Returns contents information of a given jar file.
 
+  A jar is a zip, so members are read and hashed directly from the
+  archive; nothing is extracted to disk and no jar process is spawned.
+
   Args:
     filename: a filename of a jar file.
 
@@ -53,21 +64,16 @@ def GetListOfContents(filename):
       ...
     }
   """
-  tmpdir = None
   file_to_info = {}
-  try:
-    tmpdir = tempfile.mkdtemp()
-    os.chdir(tmpdir)
-    subprocess.check_call([JAR_COMMAND_PATH, 'xf', filename])
-    for root, _, files in os.walk(tmpdir):
-      for name in files:
-        path = os.path.join(root, name)
-        file_to_info[path[len(tmpdir):]] = {
-            'size': os.stat(path).st_size,
-            'sha256': CalcFileSha256(path),
+  with zipfile.ZipFile(filename) as zf:
+    for zi in zf.infolist():
+      if zi.filename.endswith('/'):  # directory entry.
+        continue
+      with zf.open(zi) as member:
+        file_to_info[zi.filename] = {
+            'size': zi.file_size,
+            'sha256': _CalcStreamSha256(member),
         }
-  finally:
-    shutil.rmtree(tmpdir)
   return file_to_info
 
 
@@ -78,23 +84,15 @@ def VerifyNormalizedJarFile(filename, file_infos):
     filename: a normalized jar filename to verify.
     file_infos: an original jar file info got by GetListOfContents.
   """
-  tmpdir = None
-  msdos_epoch = time.mktime(datetime.datetime(1980, 1, 1, 0, 0, 0).timetuple())
-  try:
-    tmpdir = tempfile.mkdtemp()
-    os.chdir(tmpdir)
-    subprocess.check_call([JAR_COMMAND_PATH, 'xf', filename])
-    for root, _, files in os.walk(tmpdir):
-      if root != tmpdir:
-        assert os.stat(root).st_mtime == msdos_epoch
-      for name in files:
-        path = os.path.join(root, name)
-        path_info = file_infos[path[len(tmpdir):]]
-        assert os.stat(path).st_mtime == msdos_epoch
-        assert os.stat(path).st_size == path_info['size']
-        assert CalcFileSha256(path) == path_info['sha256']
-  finally:
-    shutil.rmtree(tmpdir)
+  with zipfile.ZipFile(filename) as zf:
+    for zi in zf.infolist():
+      assert zi.date_time == MSDOS_EPOCH
+      if zi.filename.endswith('/'):  # directory entry.
+        continue
+      path_info = file_infos[zi.filename]
+      assert zi.file_size == path_info['size']
+      with zf.open(zi) as member:
+        assert _CalcStreamSha256(member) == path_info['sha256']
 
 
 def main(argv):
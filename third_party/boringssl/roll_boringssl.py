@@ -12,11 +12,13 @@
 
 """Rolls third_party/boringssl/src in DEPS and updates generated build files."""
 
+import multiprocessing.pool
 import os
 import os.path
 import shutil
 import subprocess
 import sys
+import tempfile
 
 
 SCRIPT_PATH = os.path.abspath(__file__)
@@ -38,12 +40,22 @@ GENERATED_FILES = [
     'err_data.c',
 ]
 
+# Per-OS/arch generated directories, precomputed from the boringssl table so
+# the roll loops below do not rebuild the names.
+COMBO_DIRNAMES = [
+    osname + '-' + arch
+    for (osname, arch, _, _, _) in generate_build_files.OS_ARCH_COMBOS]
+COMBO_DIRS = [os.path.join(BORINGSSL_PATH, dirname)
+              for dirname in COMBO_DIRNAMES]
+
 
 def IsPristine(repo):
   """Returns True if a git checkout is pristine."""
-  cmd = ['git', 'diff', '--ignore-submodules']
-  return not (subprocess.check_output(cmd, cwd=repo).strip() or
-              subprocess.check_output(cmd + ['--cached'], cwd=repo).strip())
+  # Diffing against HEAD covers both staged and unstaged changes with a
+  # single git invocation; --quiet reports through the exit code without
+  # materializing the diff text.
+  cmd = ['git', 'diff', '--quiet', '--ignore-submodules', 'HEAD']
+  return subprocess.call(cmd, cwd=repo) == 0
 
 
 def RevParse(repo, rev):
@@ -55,11 +67,40 @@ def UpdateDEPS(deps, from_hash, to_hash):
   """Updates all references of |from_hash| to |to_hash| in |deps|."""
   with open(deps, 'rb') as f:
     contents = f.read()
-    if from_hash not in contents:
-      raise Exception('%s not in DEPS' % from_hash)
-  contents = contents.replace(from_hash, to_hash)
-  with open(deps, 'wb') as f:
-    f.write(contents)
+  if from_hash not in contents:
+    raise Exception('%s not in DEPS' % from_hash)
+  # Write the result to a sibling file and rename it into place, so an
+  # interrupted run cannot leave a truncated DEPS behind.
+  fd, tmp_path = tempfile.mkstemp(prefix='DEPS.', dir=os.path.dirname(deps))
+  try:
+    with os.fdopen(fd, 'wb') as f:
+      f.write(contents.replace(from_hash, to_hash))
+    os.chmod(tmp_path, os.stat(deps).st_mode)
+    os.rename(tmp_path, deps)
+  except:
+    os.unlink(tmp_path)
+    raise
+
+
+def RemoveTrees(paths):
+  """Removes directory trees in parallel.
+
+  rmtree spends its time waiting on unlink syscalls, so independent trees
+  are removed concurrently.  Failures are reported and skipped.
+  """
+  def Remove(path):
+    try:
+      shutil.rmtree(path)
+    except OSError as e:
+      print 'failed to remove but continue %s: %s' % (path, e)
+  if not paths:
+    return
+  pool = multiprocessing.pool.ThreadPool(min(len(paths), 8))
+  try:
+    pool.map(Remove, paths)
+  finally:
+    pool.close()
+    pool.join()
 
 
 def main():
@@ -76,11 +117,17 @@ def main():
 
   if len(sys.argv) > 1:
     new_head = RevParse(BORINGSSL_SRC_PATH, sys.argv[1])
+    old_head = RevParse(BORINGSSL_SRC_PATH, 'HEAD')
   else:
+    # Resolving HEAD does not depend on the fetch; run it while the
+    # network transfer is in flight.
+    pool = multiprocessing.pool.ThreadPool(1)
+    old_head_result = pool.apply_async(RevParse, (BORINGSSL_SRC_PATH, 'HEAD'))
     subprocess.check_call(['git', 'fetch', 'origin'], cwd=BORINGSSL_SRC_PATH)
     new_head = RevParse(BORINGSSL_SRC_PATH, 'origin/master')
-
-  old_head = RevParse(BORINGSSL_SRC_PATH, 'HEAD')
+    old_head = old_head_result.get()
+    pool.close()
+    pool.join()
   if old_head == new_head:
     print 'BoringSSL already up to date.'
     return 0
@@ -93,55 +140,56 @@ def main():
   subprocess.check_call(['git', 'checkout', new_head], cwd=BORINGSSL_SRC_PATH)
 
   # Clear the old generated files.
-  for (osname, arch, _, _, _) in generate_build_files.OS_ARCH_COMBOS:
-    path = os.path.join(BORINGSSL_PATH, osname + '-' + arch)
-    try:
-      shutil.rmtree(path)
-    except OSError as e:
-      print 'failed to remove but continue %s: %s' % (path, e)
+  RemoveTrees(COMBO_DIRS)
   for f in GENERATED_FILES:
     path = os.path.join(BORINGSSL_PATH, f)
     os.unlink(path)
 
-  # Generate new ones.
-  subprocess.check_call(['python',
+  # Generate new ones.  This must run the generate_build_files.py from the
+  # revision checked out above, not the module imported before the
+  # checkout, and sys.executable avoids resolving 'python' through shims
+  # to a different interpreter.
+  subprocess.check_call([sys.executable,
                          os.path.join(BORINGSSL_SRC_PATH, 'util',
                                       'generate_build_files.py'),
                          'gn'],
                         cwd=BORINGSSL_PATH)
 
-  # Commit everything except dirs in .gitignore.
-  gitignore = []
+  # Commit everything except dirs in .gitignore.  A frozenset makes the
+  # per-combo membership checks below O(1).
+  gitignore = frozenset()
   try:
     with open(os.path.join(BORINGSSL_PATH, '.gitignore')) as f:
-      gitignore = f.read().splitlines()
+      gitignore = frozenset(f.read().splitlines())
   except OSError as e:
     print 'cannot access .gitignore file exist: %s' % e
-  for entry in gitignore:
-    path = os.path.join(BORINGSSL_PATH, entry)
-    try:
-      shutil.rmtree(path)
-    except OSError as e:
-      print 'failed to remove but continue %s: %s' % (path, e)
-  subprocess.check_call(['git', 'add', DEPS_PATH], cwd=SRC_PATH)
-  for (osname, arch, _, _, _) in generate_build_files.OS_ARCH_COMBOS:
-    dirname = osname + '-' + arch
+  RemoveTrees([os.path.join(BORINGSSL_PATH, entry) for entry in gitignore])
+  # Stage everything with one git invocation; one git add per path pays
+  # process spawn and index lock costs for every OS/arch combo.
+  paths_to_add = [DEPS_PATH]
+  for dirname, path in zip(COMBO_DIRNAMES, COMBO_DIRS):
     if dirname in gitignore:
       continue
-    path = os.path.join(BORINGSSL_PATH, dirname)
-    subprocess.check_call(['git', 'add', path], cwd=SRC_PATH)
+    paths_to_add.append(path)
   for f in GENERATED_FILES:
-    path = os.path.join(BORINGSSL_PATH, f)
-    subprocess.check_call(['git', 'add', path], cwd=SRC_PATH)
+    paths_to_add.append(os.path.join(BORINGSSL_PATH, f))
+  subprocess.check_call(['git', 'add', '--'] + paths_to_add, cwd=SRC_PATH)
 
-  # Remove removed files from the repository.
+  # Remove removed files from the repository with one git rm; -z output is
+  # NUL separated, so unusual filenames need no unquoting.
   changed_files = subprocess.check_output(
-      ['git', 'diff', '--name-only']).splitlines()
+      ['git', 'diff', '--name-only', '-z']).split('\0')
+  to_remove = []
   for fname in changed_files:
-    if fname.startswith(BORINGSSL_INSIDE_REPO_PATH):
-      fname = fname.replace(BORINGSSL_INSIDE_REPO_PATH, BORINGSSL_PATH)
-    if not os.path.exists(fname):
-      subprocess.check_call(['git', 'rm', fname], cwd=SRC_PATH)
+    if not fname:
+      continue
+    path = fname
+    if path.startswith(BORINGSSL_INSIDE_REPO_PATH):
+      path = path.replace(BORINGSSL_INSIDE_REPO_PATH, BORINGSSL_PATH)
+    if not os.path.exists(path):
+      to_remove.append(fname)
+  if to_remove:
+    subprocess.check_call(['git', 'rm', '--'] + to_remove, cwd=SRC_PATH)
 
   commits = subprocess.check_output(
       ['git', 'log', '--oneline', '%s..%s' % (old_head, new_head)],
@@ -156,7 +204,14 @@ Details: https://boringssl.googlesource.com/boringssl/+log/%s..%s
 
 """ % (old_head[:9], new_head[:9], commits, old_head, new_head)
 
-  subprocess.check_call(['git', 'commit', '-m', message], cwd=SRC_PATH)
+  # The message embeds the whole oneline log; feed it through stdin so a
+  # big roll cannot run into argv size limits.
+  commit_proc = subprocess.Popen(['git', 'commit', '-F', '-'],
+                                 stdin=subprocess.PIPE, cwd=SRC_PATH)
+  commit_proc.communicate(message)
+  if commit_proc.returncode:
+    raise subprocess.CalledProcessError(commit_proc.returncode,
+                                        'git commit -F -')
 
   # Print update notes.
   notes = subprocess.check_output(
@@ -7,6 +7,7 @@
 
 
 import argparse
+import os
 import subprocess
 import sys
 
@@ -21,15 +22,20 @@ def main():
   # cmd = "$(location :js_embed) $(SRCS) > $@",
   cmd = [ args.generator ] + args.inputs
 
-  p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-  stdout_data, _ = p.communicate()
-
-  if p.returncode != 0:
-    print >>sys.stderr, 'failed to run js_embed: exit_status=', p.returncode
+  # Let the generator write straight to the output file instead of
+  # draining a pipe through python and writing the buffer back out.  A
+  # sibling temp file is renamed into place on success so a failed run
+  # cannot leave a partial output behind.
+  tmp_path = args.output_path + '.tmp'
+  with open(tmp_path, 'wb') as f:
+    returncode = subprocess.call(cmd, stdout=f)
+
+  if returncode != 0:
+    os.unlink(tmp_path)
+    print >>sys.stderr, 'failed to run js_embed: exit_status=', returncode
     sys.exit(1)
 
-  with open(args.output_path, 'wb') as f:
-    f.write(stdout_data)
+  os.rename(tmp_path, args.output_path)
 
 
 if __name__ == '__main__':
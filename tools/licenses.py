@@ -37,9 +37,13 @@ def ReadFile(path):
     return f.read()
 
 
+# Filenames that look like a license file.
+LICENSE_NAMES = frozenset(['LICENSE', 'LICENSE.md', 'COPYING', 'COPYING.txt'])
+
+
 def IsLicenseFile(name):
   """Returns true if name looks like a license file."""
-  return name in ['LICENSE', 'LICENSE.md', 'COPYING', 'COPYING.txt']
+  return name in LICENSE_NAMES
 
 
 def FindLicense(third_party_dir, library_name):
@@ -50,6 +54,9 @@ def FindLicense(third_party_dir, library_name):
     return ReadFile(os.path.join(third_party_dir,
                     SPECIAL_CASES[library_name]['path']))
 
+  # os.walk yields the library root first and lists subdirectories lazily,
+  # so when the license sits at the root (the usual case) this costs one
+  # readdir and never descends into the tree.
   for curdir, dirs, files in os.walk(os.path.join(third_party_dir,
                                                   library_name)):
     for f in files:
@@ -60,15 +67,17 @@ def FindLicense(third_party_dir, library_name):
   return None
 
 
-def AddLicenseFile(license, name, contents):
-  """Add contents to license with title name."""
+def AddLicenseFile(parts, name, contents):
+  """Appends contents with title name to the parts list.
 
-  if license != '':
-    license += '\n\n'
-  license += name + '\n'
-  license += '=' * len(name) + '\n'
-  license += contents
-  return license
+  The output is accumulated as a list joined once at the end; building it
+  with += would copy the whole string on every addition.
+  """
+  if parts:
+    parts.append('\n\n')
+  parts.append(name + '\n')
+  parts.append('=' * len(name) + '\n')
+  parts.append(contents)
 
 
 def main():
@@ -79,9 +88,9 @@ def main():
   args = parser.parse_args()
 
   # First, process goma client LICENSE file.
-  result = ''
+  parts = []
   if os.path.exists(args.goma_license):
-    result = AddLicenseFile(result, 'Goma Client', ReadFile(args.goma_license))
+    AddLicenseFile(parts, 'Goma Client', ReadFile(args.goma_license))
 
   # Then, process third_party license files.
   for d in sorted(os.listdir(args.third_party_dir)):
@@ -92,10 +101,10 @@ def main():
     license = FindLicense(args.third_party_dir, d)
     if not license:
       raise Exception('license file not found in {}'.format(d))
-    result = AddLicenseFile(result, d, license)
+    AddLicenseFile(parts, d, license)
 
   with open(args.output_file, 'w') as f:
-      f.write(result)
+      f.write(''.join(parts))
 
 
 if __name__ == '__main__':